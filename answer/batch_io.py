@@ -0,0 +1,116 @@
+import sys
+import errno
+import socket
+import struct
+import ctypes
+
+MSG_DONTWAIT = 0x40
+MSG_WAITFORONE = 0x10000
+SOCKADDR_IN_SIZE = 16
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32), ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t), ('msg_flags', ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+libc = None
+if sys.platform.startswith('linux'):
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    except (OSError, AttributeError):
+        # No recvmmsg/sendmmsg in this libc; BatchSocket falls back to one syscall per datagram
+        libc = None
+
+MMSG_AVAILABLE = libc is not None
+
+def encode_sockaddr(addr):
+    """Pack an (ip, port) pair as a struct sockaddr_in."""
+    return struct.pack('=H', socket.AF_INET) + struct.pack('!H', addr[1]) + socket.inet_aton(addr[0]) + bytes(8)
+
+def decode_sockaddr(raw):
+    """Unpack a struct sockaddr_in into an (ip, port) pair."""
+    return socket.inet_ntoa(raw[4:8]), struct.unpack_from('!H', raw, 2)[0]
+
+class BatchSocket:
+    """
+    Datagram I/O on a blocking IPv4 UDP socket, many datagrams per syscall. recv() waits for at least one
+    datagram and returns everything already queued, up to batch_size, with one recvmmsg(); send() hands a
+    list of replies to sendmmsg(). Receive buffers are allocated once, so recv() is meant for a single
+    thread; send() may be called from any thread. Without recvmmsg/sendmmsg the same interface is served
+    with recvfrom/sendto.
+    """
+    def __init__(self, sock, batch_size=64, buffer_size=65535):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        if not MMSG_AVAILABLE:
+            return
+        self.buffers = [ctypes.create_string_buffer(buffer_size) for _ in range(batch_size)]
+        self.names = [ctypes.create_string_buffer(SOCKADDR_IN_SIZE) for _ in range(batch_size)]
+        self.iovecs = (iovec * batch_size)()
+        self.headers = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self.iovecs[i].iov_base = ctypes.addressof(self.buffers[i])
+            self.iovecs[i].iov_len = buffer_size
+            self.headers[i].msg_hdr.msg_name = ctypes.addressof(self.names[i])
+            self.headers[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.headers[i].msg_hdr.msg_iovlen = 1
+
+    def recv(self):
+        """Return a list of (data, addr), blocking until at least one datagram has arrived."""
+        if not MMSG_AVAILABLE:
+            messages = [self.sock.recvfrom(self.buffer_size)]
+            try:
+                while len(messages) < self.batch_size:
+                    messages.append(self.sock.recvfrom(self.buffer_size, MSG_DONTWAIT))
+            except BlockingIOError:
+                pass
+            return messages
+        for i in range(self.batch_size):
+            # The kernel overwrites msg_namelen with the length of the address it stored
+            self.headers[i].msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+        while True:
+            count = libc.recvmmsg(self.sock.fileno(), self.headers, self.batch_size, MSG_WAITFORONE, None)
+            if count >= 0:
+                break
+            error = ctypes.get_errno()
+            if error != errno.EINTR:
+                raise OSError(error, 'recvmmsg failed')
+        return [(ctypes.string_at(self.buffers[i], self.headers[i].msg_len), decode_sockaddr(self.names[i].raw)) for i in range(count)]
+
+    def send(self, messages):
+        """Send a list of (data, addr) replies; returns how many were sent."""
+        if not MMSG_AVAILABLE:
+            for data, addr in messages:
+                self.sock.sendto(data, addr)
+            return len(messages)
+        count = len(messages)
+        # Keep the Python objects alive until sendmmsg() returns; the headers only hold their addresses
+        datas = [data for data, _ in messages]
+        names = [ctypes.create_string_buffer(encode_sockaddr(addr), SOCKADDR_IN_SIZE) for _, addr in messages]
+        iovecs = (iovec * count)()
+        headers = (mmsghdr * count)()
+        for i in range(count):
+            iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(datas[i]), ctypes.c_void_p)
+            iovecs[i].iov_len = len(datas[i])
+            headers[i].msg_hdr.msg_name = ctypes.addressof(names[i])
+            headers[i].msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+            headers[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            headers[i].msg_hdr.msg_iovlen = 1
+        sent = 0
+        while sent < count:
+            result = libc.sendmmsg(self.sock.fileno(), ctypes.cast(ctypes.addressof(headers) + sent * ctypes.sizeof(mmsghdr), ctypes.POINTER(mmsghdr)), count - sent, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                raise OSError(error, 'sendmmsg failed')
+            sent += result
+        return sent
@@ -1,28 +1,86 @@
 import sys
 import json
+import time
 import socket
+import threading
 import configparser
 
 config = configparser.ConfigParser()
 config.read('/home/mininet/Captive-Portal/config.ini')
 TCP_server_ip = config['DEFAULT']['internet_ip']
 TCP_server_port = int(config['DEFAULT']['TCP_server_port'])
+subscribe_retry_interval = float(config['DEFAULT']['subscribe_retry_interval'])
+
+# Requests sent before waiting for their responses
+PIPELINE_WINDOW = 256
 
 class TCPClient:
-    def __init__(self, host=TCP_server_ip, port=TCP_server_port):
-        """Create a TCP client that can send and receive messages from a persistent connection."""
+    def __init__(self, host=TCP_server_ip, port=TCP_server_port, timeout=None):
+        """Create a TCP client that can send and receive messages from a persistent connection; timeout bounds the connect and every read."""
         self.host = host
         self.port = port
-        self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.connection.connect((host, port))
+        self.connection = socket.create_connection((host, port), timeout=timeout)
+        self.stream = self.connection.makefile('rb')
+        self.next_id = 0
+
+    def send_requests(self, requests):
+        """
+        Pipeline several requests on the connection and return their responses in the same order.
+        Messages are newline-delimited JSON; each request carries an id that the server echoes back.
+        """
+        responses = []
+        for start in range(0, len(requests), PIPELINE_WINDOW):
+            ids = []
+            payload = []
+            for request in requests[start:start + PIPELINE_WINDOW]:
+                self.next_id += 1
+                ids.append(self.next_id)
+                payload.append(json.dumps(dict(request, id=self.next_id)) + '\n')
+            self.connection.sendall(''.join(payload).encode())
+            received = {}
+            while len(received) < len(ids):
+                line = self.stream.readline()
+                if not line:
+                    raise ConnectionError('Connection closed by server')
+                response = json.loads(line)
+                received[response.pop('id', None)] = response
+            responses.extend(received[request_id] for request_id in ids)
+        return responses
 
     def send_request(self, request):
         """Send a JSON request to the server and return the JSON response."""
-        self.connection.sendall(json.dumps(request).encode())
-        return json.loads(self.connection.recv(1024).decode())
+        return self.send_requests([request])[0]
+
+    def subscribe(self, callback):
+        """
+        Stream server events to callback(event, value) from a background thread on a dedicated connection.
+        'subscribed' is reported once the stream is live and 'disconnected' when it drops; the thread then
+        reconnects every subscribe_retry_interval seconds.
+        """
+        thread = threading.Thread(target=self._event_loop, args=(callback,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _event_loop(self, callback):
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port)) as conn:
+                    conn.sendall((json.dumps({'command': 'subscribe'}) + '\n').encode())
+                    stream = conn.makefile('rb')
+                    if json.loads(stream.readline()).get('result'):
+                        callback('subscribed', None)
+                        for line in stream:
+                            message = json.loads(line)
+                            callback(message['event'], message['value'])
+            except (OSError, ValueError):
+                pass
+            callback('disconnected', None)
+            time.sleep(subscribe_retry_interval)
 
     def close_connection(self):
         """Close the connection to the server."""
+        self.stream.close()
         self.connection.close()
 
 if __name__ == '__main__':
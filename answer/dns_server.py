@@ -1,7 +1,22 @@
-from scapy.all import *
+import os
+import sys
+import json
+import time
+import signal
+import selectors
+import random
 import socket
+import struct
+import ctypes
+import threading
 import configparser
 import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from client import TCPClient
+from neighbor import NeighborCache
+from batch_io import BatchSocket
+from log_pipeline import setup_logging
 
 config = configparser.ConfigParser()
 config.read('/home/mininet/Captive-Portal/config.ini')
@@ -9,44 +24,973 @@ DNS_Server = config['DEFAULT']['DNS_Server']
 DNS_Server_port = config['DEFAULT']['DNS_Server_port']
 internet_ip = config['DEFAULT']['internet_ip']
 captive_portal_ip = config['DEFAULT']['captive_portal_ip']
+captive_portal_host = config['DEFAULT']['captive_portal_host']
 dns_server_log = config['DEFAULT']['dns_server_log']
+dns_mode = config['DEFAULT']['dns_mode']
+dns_sniff_interface = config['DEFAULT']['dns_sniff_interface']
+dns_workers = int(config['DEFAULT']['dns_workers'])
+dns_batch_size = int(config['DEFAULT']['dns_batch_size'])
+dns_processes = int(config['DEFAULT']['dns_processes'])
+dns_cache_size = int(config['DEFAULT']['dns_cache_size'])
+dns_cache_max_ttl = int(config['DEFAULT']['dns_cache_max_ttl'])
+dns_stats_interval = float(config['DEFAULT']['dns_stats_interval'])
+DNS_Server_fallback = config['DEFAULT']['DNS_Server_fallback']
+dns_upstream_sockets = int(config['DEFAULT']['dns_upstream_sockets'])
+dns_upstream_timeout = float(config['DEFAULT']['dns_upstream_timeout'])
+dns_upstream_attempts = int(config['DEFAULT']['dns_upstream_attempts'])
+dns_upstream_rotate_queries = int(config['DEFAULT']['dns_upstream_rotate_queries'])
+dns_upstream_rotate_interval = float(config['DEFAULT']['dns_upstream_rotate_interval'])
+dns_local_zone = config['DEFAULT']['dns_local_zone']
+dns_local_ttl = int(config['DEFAULT']['dns_local_ttl'])
+dns_approval_check = config['DEFAULT']['dns_approval_check']
+approval_cache_ttl = float(config['DEFAULT']['approval_cache_ttl'])
+approval_cache_negative_ttl = float(config['DEFAULT']['approval_cache_negative_ttl'])
+approval_cache_subscribed_ttl = float(config['DEFAULT']['approval_cache_subscribed_ttl'])
+approval_check_timeout = float(config['DEFAULT']['approval_check_timeout'])
+approval_retry_interval = float(config['DEFAULT']['approval_retry_interval'])
+approval_retry_max = float(config['DEFAULT']['approval_retry_max'])
+neighbor_cache_ttl = float(config['DEFAULT']['neighbor_cache_ttl'])
+dns_edns_buffer_size = int(config['DEFAULT']['dns_edns_buffer_size'])
+dns_tcp_idle_timeout = float(config['DEFAULT']['dns_tcp_idle_timeout'])
 
-# Setup logging
-logging.basicConfig(filename=dns_server_log, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# DNS_Server first, then the fallbacks in the order listed
+dns_upstreams = [(server.strip(), int(DNS_Server_port)) for server in [DNS_Server] + DNS_Server_fallback.split(',') if server.strip()]
 
-def forward_dns_query(data, server=DNS_Server, port=int(DNS_Server_port)):
-    """Forward DNS query to a specified DNS server and return the response."""
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.settimeout(2)  # Set a timeout
-        sock.sendto(data, (server, port))
+# Setup logging; per-query events go to their own logger so they can be sampled or silenced
+setup_logging(dns_server_log, 'dns')
+query_log = logging.getLogger('dns.query')
+
+# Largest datagram we read from clients or upstream servers
+DNS_BUFFER_SIZE = 65535
+# Largest UDP response a client that does not use EDNS0 accepts (RFC 1035)
+DNS_UDP_LIMIT = 512
+# Largest DNS payload the sniff mode sends in one unfragmented Ethernet frame (1500 - IPv4 - UDP headers)
+DNS_FRAME_LIMIT = 1472
+# Largest frame the sniff mode reads: a full datagram behind an Ethernet header
+FRAME_BUFFER_SIZE = 65535 + 14
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_OUTGOING = 4
+SO_ATTACH_FILTER = 26
+# Classic BPF for 'ip and udp dst port 53' (as printed by tcpdump -dd), so the kernel only copies DNS queries to us
+DNS_QUERY_FILTER = [
+    (0x28, 0, 0, 0x0000000c), (0x15, 0, 8, 0x00000800), (0x30, 0, 0, 0x00000017), (0x15, 0, 6, 0x00000011),
+    (0x28, 0, 0, 0x00000014), (0x45, 4, 0, 0x00001fff), (0xb1, 0, 0, 0x0000000e), (0x48, 0, 0, 0x00000010),
+    (0x15, 0, 1, 0x00000035), (0x06, 0, 0, 0x00040000), (0x06, 0, 0, 0x00000000),
+]
+
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_OPT = 41
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+CLASS_IN = 1
+
+def parse_question(data):
+    """
+    Return (qname, qtype, qclass) of the first question in a raw DNS message, or None if it is malformed.
+    qname is for display only: a label may itself contain dots, so use question_key() to tell names apart.
+    """
+    try:
+        if struct.unpack_from('!H', data, 4)[0] < 1:
+            return None
+        labels = []
+        offset = 12
+        while data[offset]:
+            length = data[offset]
+            if length & 0xc0:
+                # Compression pointers have no place in a question's name
+                return None
+            labels.append(data[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+            offset += length + 1
+        qtype, qclass = struct.unpack_from('!HH', data, offset + 1)
+    except (IndexError, struct.error):
+        return None
+    return '.'.join(labels), qtype, qclass
+
+def skip_name(data, offset):
+    """Return the offset just past the (possibly compressed) domain name starting at offset."""
+    while True:
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            return offset + 2
+        if not length:
+            return offset + 1
+        offset += length + 1
+
+def encode_name(name):
+    """Encode a dotted name in wire form, lower-cased."""
+    return b''.join(bytes([len(label)]) + label for label in name.lower().rstrip('.').encode('ascii').split(b'.') if label) + b'\x00'
+
+def question_key(data):
+    """
+    Cache and coalescing key of a message that parse_question() accepted: the question name in wire form,
+    lower-cased, plus the raw QTYPE and QCLASS. Unlike the dotted qname, it keeps a label containing a dot
+    (b'www.google' then b'com') apart from www.google.com, and non-ASCII labels apart from each other.
+    """
+    name_end = skip_name(data, 12)
+    return data[12:name_end].lower() + data[name_end:name_end + 4]
+
+def question_end(data):
+    """Return the offset just past the question section of a message with one question."""
+    return skip_name(data, 12) + 4
+
+def parse_records(data):
+    """
+    Yield (section, rtype, start, ttl_offset, end) for every resource record after the question, where
+    section is 0, 1 or 2 for answer, authority and additional, and the record's RDATA starts at ttl_offset + 6.
+    Raises IndexError/struct.error if truncated.
+    """
+    counts = struct.unpack_from('!HHH', data, 6)
+    offset = question_end(data)
+    for section, count in enumerate(counts):
+        for _ in range(count):
+            start = offset
+            offset = skip_name(data, offset)
+            rtype, _, _, rdlength = struct.unpack_from('!HHIH', data, offset)
+            yield section, rtype, start, offset + 4, offset + 10 + rdlength
+            offset += 10 + rdlength
+
+def response_ttl(data):
+    """
+    How long a response may be cached: the smallest TTL of its records, or for NXDOMAIN/NODATA the
+    smaller of the SOA TTL and SOA MINIMUM (RFC 2308). 0 means do not cache.
+    """
+    try:
+        flags, _, ancount = struct.unpack_from('!HHH', data, 2)
+        rcode = flags & 0x000f
+        if flags & FLAG_TC or rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            return 0
+        ttls = []
+        negative = rcode == RCODE_NXDOMAIN or ancount == 0
+        for section, rtype, _, ttl_offset, _ in parse_records(data):
+            if rtype == TYPE_OPT:
+                continue
+            ttl = struct.unpack_from('!I', data, ttl_offset)[0]
+            if negative:
+                if section == 1 and rtype == TYPE_SOA:
+                    # MINIMUM is the last field of the SOA RDATA, after two names and four counters
+                    minimum_offset = skip_name(data, skip_name(data, ttl_offset + 6)) + 16
+                    return min(ttl, struct.unpack_from('!I', data, minimum_offset)[0])
+            elif section < 2:
+                ttls.append(ttl)
+    except (IndexError, struct.error):
+        return 0
+    return min(ttls) if ttls and not negative else 0
+
+def find_opt(data):
+    """Return (start, end, udp_size) of the EDNS0 OPT record in a message, or None if it has none or is malformed."""
+    try:
+        for section, rtype, start, ttl_offset, end in parse_records(data):
+            if section == 2 and rtype == TYPE_OPT:
+                # The OPT record's CLASS field carries the sender's UDP payload size
+                return start, end, struct.unpack_from('!H', data, ttl_offset - 2)[0]
+    except (IndexError, struct.error):
+        pass
+    return None
+
+def add_opt(query, udp_size):
+    """Append an OPT record advertising udp_size to a query that has none."""
+    arcount = struct.unpack_from('!H', query, 10)[0]
+    return query[:10] + struct.pack('!H', arcount + 1) + query[12:] + b'\x00' + struct.pack('!HHIH', TYPE_OPT, udp_size, 0, 0)
+
+def strip_opt(response, opt):
+    """Remove the OPT record located by find_opt() from a response."""
+    start, end, _ = opt
+    arcount = struct.unpack_from('!H', response, 10)[0]
+    return response[:10] + struct.pack('!H', arcount - 1) + response[12:start] + response[end:]
+
+def truncate(response):
+    """Cut a response down to its header and question with TC set, telling the client to retry over TCP."""
+    flags = struct.unpack_from('!H', response, 2)[0] | FLAG_TC
+    return response[:2] + struct.pack('!HHHHH', flags, 1, 0, 0, 0) + response[12:question_end(response)]
+
+def read_message(stream):
+    """Read one length-prefixed DNS message from a TCP stream, or return None at end of stream."""
+    header = stream.read(2)
+    if len(header) < 2:
+        return None
+    length = struct.unpack('!H', header)[0]
+    data = stream.read(length)
+    return data if len(data) == length else None
+
+def tcp_query(data, upstream, timeout):
+    """Send one query to upstream over TCP and return its response, or None on failure."""
+    try:
+        with socket.create_connection(upstream, timeout=timeout) as sock:
+            sock.sendall(struct.pack('!H', len(data)) + data)
+            with sock.makefile('rb') as stream:
+                return read_message(stream)
+    except OSError as e:
+        logging.warning(f"TCP query to DNS server {upstream[0]}:{upstream[1]} failed: {e}")
+        return None
+
+def rewrite_response(query, response):
+    """Address response to query: copy in its transaction ID and question (which may differ only in letter case)."""
+    end = question_end(query)
+    return query[:2] + response[2:12] + query[12:end] + response[end:]
+
+def ttl_offsets(data):
+    """Return [(offset, ttl)] for every record of a response except OPT, whose TTL field holds flags."""
+    try:
+        return [(ttl_offset, struct.unpack_from('!I', data, ttl_offset)[0]) for _, rtype, _, ttl_offset, _ in parse_records(data) if rtype != TYPE_OPT]
+    except (IndexError, struct.error):
+        return []
+
+class DNSCache:
+    """
+    LRU cache of raw DNS responses keyed on question_key(). An entry lives for response_ttl(),
+    capped at max_ttl. A hit is the cached bytes with the client's transaction ID and question copied in
+    (the question may differ only in letter case), so nothing is re-encoded. The offsets of the record
+    TTLs are found once on insert, and on a hit every TTL is lowered in place by the time spent cached.
+    invalidate() takes no lock, so it is safe from a signal handler; the next get() or put() clears.
+    """
+    def __init__(self, size=dns_cache_size, max_ttl=dns_cache_max_ttl):
+        self.size = size
+        self.max_ttl = max_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self.cleared_generation = 0
+
+    def invalidate(self):
+        """Drop every entry, lazily: only a counter is bumped here."""
+        self.generation += 1
+
+    def expire_invalidated(self):
+        # Called with self.lock held
+        generation = self.generation
+        if generation != self.cleared_generation:
+            self.entries.clear()
+            self.cleared_generation = generation
+
+    def get(self, key, query):
+        now = time.time()
+        with self.lock:
+            self.expire_invalidated()
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        response, _, stored_at, ttls = entry
+        elapsed = int(now - stored_at)
+        if not elapsed:
+            return rewrite_response(query, response)
+        patched = bytearray(rewrite_response(query, response))
+        for offset, ttl in ttls:
+            struct.pack_into('!I', patched, offset, max(ttl - elapsed, 0))
+        return bytes(patched)
+
+    def put(self, key, response):
+        ttl = min(response_ttl(response), self.max_ttl)
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self.lock:
+            self.expire_invalidated()
+            self.entries[key] = (response, now + ttl, now, ttl_offsets(response))
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.cleared_generation = self.generation
+
+def encode_a_records(addresses, ttl):
+    """Pre-encode A records for addresses as (count, bytes), each pointing back at the question name."""
+    records = b''.join(struct.pack('!HHHIH', 0xc00c, TYPE_A, CLASS_IN, ttl, 4) + socket.inet_aton(address) for address in addresses)
+    return len(addresses), records
+
+def local_response(query, qtype, answer):
+    """Build an authoritative response to query from encode_a_records() output; non-A queries get no records."""
+    count, records = answer if qtype == TYPE_A else (0, b'')
+    flags = 0x8480 | (struct.unpack_from('!H', query, 2)[0] & FLAG_RD)
+    return query[:2] + struct.pack('!HHHHH', flags, 1, count, 0, 0) + query[12:question_end(query)] + records
+
+class ApprovalView:
+    """
+    Cached view of the MAC authorization server, for approval-aware answers. The server's event stream
+    keeps it coherent, and misses are answered with a 'check' request that gives up after timeout seconds.
+    If the server cannot be reached, the client is treated as approved so DNS keeps working; that answer
+    is cached for approval_cache_negative_ttl, and reconnects back off exponentially up to retry_max seconds.
+    """
+    def __init__(self, timeout=approval_check_timeout, retry_interval=approval_retry_interval, retry_max=approval_retry_max):
+        self.entries = {}
+        self.ttl = approval_cache_ttl
+        self.negative_ttl = approval_cache_negative_ttl
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.retry_max = retry_max
+        self.retry_delay = 0
+        self.retry_at = 0
+        self.client = None
+        self.subscription = None
+        self.lock = threading.Lock()
+
+    def on_event(self, event, value):
+        if event == 'add':
+            self.set(value, True)
+        elif event in ('remove', 'expire'):
+            self.set(value, False)
+        elif event == 'subscribed':
+            self.ttl = self.negative_ttl = approval_cache_subscribed_ttl
+            self.entries = {}
+        elif event == 'disconnected':
+            self.ttl = approval_cache_ttl
+            self.negative_ttl = approval_cache_negative_ttl
+            self.entries = {}
+
+    def set(self, mac, approved):
+        self.entries[mac] = (approved, time.time() + (self.ttl if approved else self.negative_ttl))
+
+    def cached(self, mac):
+        """The cached answer for mac, or None if it has to be checked with the server."""
+        entry = self.entries.get(mac)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def is_approved(self, mac):
+        approved = self.cached(mac)
+        if approved is not None:
+            return approved
+        # Another thread is already waiting on the server; do not queue up behind it
+        if not self.lock.acquire(timeout=self.timeout):
+            return True
+        try:
+            approved = self.cached(mac)
+            if approved is not None:
+                return approved
+            if time.time() < self.retry_at:
+                approved = None
+            else:
+                approved = self.check(mac)
+            if approved is None:
+                # Fail open, but only briefly so the client is checked again soon. Not self.negative_ttl:
+                # while subscribed that is long, and no event would ever correct this entry
+                self.entries[mac] = (True, time.time() + approval_cache_negative_ttl)
+                return True
+        finally:
+            self.lock.release()
+        self.set(mac, approved)
+        return approved
+
+    def check(self, mac):
+        """Ask the server about mac; None if it could not be reached. Called with self.lock held."""
+        try:
+            if self.client is None:
+                self.client = TCPClient(timeout=self.timeout)
+                if self.subscription is None:
+                    self.subscription = self.client.subscribe(self.on_event)
+            approved = self.client.send_request({'command': 'check', 'value': mac})['result']
+        except (OSError, ValueError, KeyError) as e:
+            self.retry_delay = min(self.retry_delay * 2 or self.retry_interval, self.retry_max)
+            self.retry_at = time.time() + self.retry_delay
+            logging.warning(f"Could not check MAC {mac} with the authorization server, retrying in {self.retry_delay:g}s: {e}")
+            if self.client is not None:
+                self.client.close_connection()
+                self.client = None
+            return None
+        self.retry_delay = 0
+        return approved
+
+class LocalZone:
+    """
+    Names we answer ourselves, authoritatively and without going upstream: the captive portal host plus
+    the name=ip pairs listed in dns_local_zone. Answer records are encoded once at startup, so a lookup
+    is a dict get and a concatenation. Other query types for a local name get an empty NOERROR answer.
+    """
+    def __init__(self, records=None, ttl=dns_local_ttl):
+        if records is None:
+            records = [(captive_portal_host, captive_portal_ip)]
+            for entry in dns_local_zone.split(','):
+                if '=' in entry:
+                    name, address = entry.split('=', 1)
+                    records.append((name.strip(), address.strip()))
+        addresses = {}
+        for name, address in records:
+            addresses.setdefault(encode_name(name), []).append(address)
+        self.answers = {name: encode_a_records(addresses, ttl) for name, addresses in addresses.items()}
+
+    def __contains__(self, name):
+        return name in self.answers
+
+    def answer(self, query, name, qtype):
+        """Build the response to query for a local name (in lower-cased wire form, as in question_key())."""
+        return local_response(query, qtype, self.answers[name])
+
+class UpstreamPool:
+    """
+    Sends upstream queries over a few UDP sockets instead of a new socket per query. Each socket has its
+    own OS-chosen source port and a receiver thread. Every attempt gets a fresh random query ID, so an
+    answer is matched to its query by socket, ID, upstream address and question. So that a spoofer has
+    to guess the source port as well as the ID, a socket is replaced by one on a fresh ephemeral port
+    after rotate_queries queries or rotate_interval seconds; the old one keeps receiving for timeout
+    seconds so answers already on their way are not lost, then is closed.
+    Identical concurrent queries (same key) are coalesced into one upstream request. An attempt that
+    gets no answer within timeout is retried on the next upstream, up to attempts tries in total.
+    A truncated (TC) answer is fetched again from the same upstream over TCP.
+    """
+    def __init__(self, upstreams=dns_upstreams, sockets=dns_upstream_sockets, timeout=dns_upstream_timeout, attempts=dns_upstream_attempts,
+                 rotate_queries=dns_upstream_rotate_queries, rotate_interval=dns_upstream_rotate_interval):
+        self.upstreams = upstreams
+        self.timeout = timeout
+        self.attempts = attempts
+        self.rotate_queries = rotate_queries
+        self.rotate_interval = rotate_interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.inflight = {}
+        self.timeouts = 0
+        self.coalesced = 0
+        self.truncated = 0
+        self.rotations = 0
+        # Each slot is [socket, serial, queries sent, opened at]; pending queries are keyed on the serial
+        self.socks = [None] * sockets
+        self.serial = 0
+        self.retired = {}
+        for index in range(sockets):
+            self.open_socket(index)
+
+    def open_socket(self, index):
+        """Put a socket on a new ephemeral port in slot index and start its receiver. Called with self.lock held, or before any use."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('0.0.0.0', 0))
+        # Lets the receiver notice when it has been retired
+        sock.settimeout(self.timeout)
+        self.serial += 1
+        self.socks[index] = [sock, self.serial, 0, time.time()]
+        threading.Thread(target=self.receive_forever, args=(sock, self.serial), daemon=True).start()
+        return self.socks[index]
+
+    def receive_forever(self, sock, serial):
+        while True:
+            try:
+                response, addr = sock.recvfrom(DNS_BUFFER_SIZE)
+            except socket.timeout:
+                close_at = self.retired.get(serial)
+                if close_at is not None and time.time() >= close_at:
+                    with self.lock:
+                        del self.retired[serial]
+                    sock.close()
+                    return
+                continue
+            if len(response) < 12:
+                continue
+            with self.lock:
+                entry = self.pending.get((serial, response[:2]))
+                if entry is None:
+                    continue
+                future, upstream, query = entry
+                end = question_end(query)
+                # The name may differ only in letter case; the type and class must match exactly
+                if addr != upstream or response[12:end - 4].lower() != query[12:end - 4].lower() or response[end - 4:end] != query[end - 4:end]:
+                    logging.warning(f"Ignoring mismatched DNS response from {addr[0]}")
+                    continue
+                del self.pending[(serial, response[:2])]
+            future.set_result(response)
+
+    def send(self, data, upstream):
+        """One attempt against upstream; returns the response addressed to data, or None on timeout."""
+        index = random.randrange(len(self.socks))
+        future = Future()
+        with self.lock:
+            slot = self.socks[index]
+            if slot[2] >= self.rotate_queries or time.time() - slot[3] >= self.rotate_interval:
+                self.retired[slot[1]] = time.time() + self.timeout
+                slot = self.open_socket(index)
+                self.rotations += 1
+            slot[2] += 1
+            sock, serial = slot[0], slot[1]
+            while True:
+                query_id = random.getrandbits(16).to_bytes(2, 'big')
+                if (serial, query_id) not in self.pending:
+                    break
+            query = query_id + data[2:]
+            self.pending[(serial, query_id)] = (future, upstream, query)
         try:
-            response, _ = sock.recvfrom(1024)  # Adjusting size for larger responses
-        except socket.timeout:
-            logging.warning(f"Timeout occurred while forwarding query to DNS server {server}:{port}")
+            sock.sendto(query, upstream)
+            return rewrite_response(data, future.result(self.timeout))
+        except (TimeoutError, OSError):
+            with self.lock:
+                self.pending.pop((serial, query_id), None)
+                self.timeouts += 1
+            logging.warning(f"Timeout occurred while forwarding query to DNS server {upstream[0]}:{upstream[1]}")
             return None
-    return response
-
-def dns_interceptor(packet):
-    """Intercept DNS requests and forward them to a specified DNS server."""
-    # Only intercept DNS queries from the client
-    if packet.haslayer(DNSQR) and packet[IP].src != captive_portal_ip and packet[IP].src != DNS_Server:
-        query_name = packet[DNSQR].qname.decode('utf-8').strip('.')
-        logging.info(f"Received DNS query for {query_name} from {packet[IP].src} to {packet[IP].dst}")
-        original_data = bytes(packet[UDP].payload)
-        response_data = forward_dns_query(original_data)
-        
-        if response_data:
-            response_packet = DNS(response_data)
-            # Send the response back to the client
-            spoofed_pkt = IP(dst=packet[IP].src, src=packet[IP].dst) /\
-                          UDP(dport=packet[UDP].sport, sport=packet[UDP].dport) /\
-                          DNS(id=packet[DNS].id, qr=1, aa=packet[DNS].aa, qd=packet[DNS].qd,
-                              an=response_packet.an, ns=response_packet.ns, ar=response_packet.ar)
-            send(spoofed_pkt, verbose=0)
-            logging.info(f"Forwarded DNS response to {packet[IP].src}")
+
+    def query(self, data, key=None):
+        """Resolve data upstream, sharing the request with any identical query already in flight."""
+        with self.lock:
+            leader = self.inflight.get(key) if key is not None else None
+            if leader is None:
+                future = Future()
+                if key is not None:
+                    self.inflight[key] = future
+            else:
+                self.coalesced += 1
+        if leader is not None:
+            # No deadline of our own: the leader always settles its future, and may take longer than
+            # timeout * attempts when it falls back to TCP
+            response = leader.result()
+            return rewrite_response(data, response) if response else None
+        response = None
+        try:
+            for attempt in range(self.attempts):
+                upstream = self.upstreams[attempt % len(self.upstreams)]
+                response = self.send(data, upstream)
+                if response and struct.unpack_from('!H', response, 2)[0] & FLAG_TC:
+                    self.truncated += 1
+                    response = tcp_query(data, upstream, self.timeout) or response
+                if response:
+                    break
+        finally:
+            if key is not None:
+                with self.lock:
+                    del self.inflight[key]
+            future.set_result(response)
+        return response
+
+class Miss:
+    """
+    What resolve() returns with upstream False when the answer needs blocking work. resolve_miss() carries
+    on from it, so the question is not parsed, nor the cache consulted and counted, a second time.
+    approved is None while the client's approval still has to be checked (the cache was not looked at).
+    """
+    __slots__ = ('key', 'qtype', 'client_opt', 'approved')
+
+    def __init__(self, key, qtype, client_opt, approved):
+        self.key = key
+        self.qtype = qtype
+        self.client_opt = client_opt
+        self.approved = approved
+
+class DNSResolver:
+    """
+    Turns a raw DNS query into a raw response, answering from the cache when it can. Shared by the sniff and
+    socket modes. Upstream queries always carry EDNS0 so large answers come back whole over UDP; each client
+    then gets a response that fits what it asked for: no OPT record unless it sent one, and over UDP no
+    larger than its advertised buffer (512 bytes without EDNS0), else truncated so it retries over TCP.
+    """
+    def __init__(self, upstreams=dns_upstreams, cache=None, zone=None, approvals=None, edns_buffer_size=dns_edns_buffer_size):
+        self.upstreams = upstreams
+        self.edns_buffer_size = edns_buffer_size
+        self.cache = DNSCache() if cache is None else cache
+        self.zone = LocalZone() if zone is None else zone
+        self.pool = UpstreamPool(upstreams)
+        # With approvals set, clients that have not logged in get the portal address for every name
+        self.approvals = approvals
+        self.portal_answer = encode_a_records([captive_portal_ip], 0)
+        self.local_answers = 0
+        self.portal_answers = 0
+        self.truncated = 0
+
+    def resolve(self, data, client_mac=None, tcp=False, upstream=True):
+        """
+        Return the response to data, or None if it could not be resolved. With upstream False nothing that
+        can block is done: a Miss is returned when the answer needs an upstream query or an approval check.
+        """
+        question = parse_question(data)
+        if question is None:
+            # Nothing could match an upstream answer to it
+            return None
+        qname, qtype, qclass = question
+        key = question_key(data)
+        name = key[:-4]
+        if qclass == CLASS_IN and name in self.zone:
+            self.local_answers += 1
+            return self.zone.answer(data, name, qtype)
+        approved = True
+        if self.approvals is not None and client_mac is not None:
+            approved = self.approvals.cached(client_mac)
+            if approved is False:
+                self.portal_answers += 1
+                return local_response(data, qtype, self.portal_answer)
+        client_opt = find_opt(data)
+        if approved:
+            response = self.cache.get(key, data)
+            if response is not None:
+                return self.fit(response, client_opt, tcp)
+        miss = Miss(key, qtype, client_opt, approved)
+        return self.resolve_miss(data, miss, client_mac, tcp) if upstream else miss
+
+    def resolve_miss(self, data, miss, client_mac=None, tcp=False):
+        """Finish resolving data from the Miss that resolve() returned for it; None if it could not be resolved."""
+        if miss.approved is None:
+            if not self.approvals.is_approved(client_mac):
+                self.portal_answers += 1
+                return local_response(data, miss.qtype, self.portal_answer)
+            response = self.cache.get(miss.key, data)
+            if response is not None:
+                return self.fit(response, miss.client_opt, tcp)
+        upstream_query = data if miss.client_opt else add_opt(data, self.edns_buffer_size)
+        response = self.pool.query(upstream_query, miss.key)
+        if response:
+            self.cache.put(miss.key, response)
+        return self.fit(response, miss.client_opt, tcp) if response else response
+
+    def fit(self, response, client_opt, tcp):
+        """Adapt an upstream response to the client: drop our OPT record if it sent none and enforce its UDP buffer size."""
+        if client_opt is None:
+            opt = find_opt(response)
+            if opt is not None:
+                response = strip_opt(response, opt)
+        if not tcp and len(response) > max(DNS_UDP_LIMIT, client_opt[2] if client_opt else 0):
+            self.truncated += 1
+            return truncate(response)
+        return response
+
+    def stats(self):
+        return {'local_answers': self.local_answers, 'portal_answers': self.portal_answers, 'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses, 'cache_entries': len(self.cache.entries),
+                'upstream_timeouts': self.pool.timeouts, 'upstream_coalesced': self.pool.coalesced,
+                'upstream_truncated': self.pool.truncated, 'upstream_rotations': self.pool.rotations, 'client_truncated': self.truncated}
+
+    def log_stats_forever(self, interval=dns_stats_interval, report=None):
+        """Every interval seconds, log the statistics, or pass them to report if given."""
+        while True:
+            time.sleep(interval)
+            if report is None:
+                logging.info(f"DNS statistics: {self.stats()}")
+            else:
+                report(self.stats())
+
+def make_resolver():
+    """A resolver as configured. Its upstream pool opens sockets and starts threads, so supervisor mode only builds one after fork()."""
+    return DNSResolver(approvals=ApprovalView() if dns_approval_check == 'True' else None)
+
+# The sniff mode's resolver, set by __main__
+resolver = None
+neighbors = NeighborCache(ttl=neighbor_cache_ttl)
+
+def parse_frame(frame):
+    """
+    Return (src_mac, src_ip, dst_ip, sport, dport, payload) of a raw Ethernet/IPv4/UDP frame, with the
+    addresses as packed bytes, or None if the frame is anything else.
+    """
+    if len(frame) < 42 or frame[12:14] != b'\x08\x00' or frame[23] != 17:
+        return None
+    udp = 14 + (frame[14] & 0x0f) * 4
+    sport, dport, length = struct.unpack_from('!HHH', frame, udp)
+    return frame[6:12], frame[26:30], frame[30:34], sport, dport, frame[udp + 8:udp + length]
+
+def build_udp_packet(src, dst, sport, dport, payload):
+    """
+    Wrap payload in IPv4 and UDP headers for a raw IPPROTO_RAW socket. The kernel fills in the IP
+    checksum and ID, and a zero UDP checksum means none was computed (RFC 768).
+    """
+    return struct.pack('!BBHHHBBH4s4sHHHH', 0x45, 0, 28 + len(payload), 0, 0, 64, 17, 0, src, dst, sport, dport, 8 + len(payload), 0) + payload
+
+# Queries from these addresses are the portal's own traffic, not clients'
+ignored_sources = {socket.inet_aton(captive_portal_ip), socket.inet_aton(DNS_Server)}
+reply_socket = None
+
+def handle_frame(frame):
+    """
+    Sniff mode: answer a DNS query seen as a raw Ethernet frame, spoofing the reply from the address it
+    was sent to. Only the DNS header and question are read, and the reply is the resolver's response
+    bytes behind hand-built IP and UDP headers, so no packet objects are built.
+    """
+    fields = parse_frame(frame)
+    if fields is None:
+        return
+    src_mac, src, dst, sport, dport, data = fields
+    # Only intercept DNS queries (QR clear) from the clients
+    if dport != 53 or len(data) < 12 or data[2] & 0x80 or src in ignored_sources:
+        return
+    question = parse_question(data)
+    if question is None:
+        return
+    client_ip = socket.inet_ntoa(src)
+    query_log.info("Received DNS query for %s from %s to %s", question[0], client_ip, socket.inet_ntoa(dst))
+    response_data = resolver.resolve(data, src_mac.hex(':') if resolver.approvals is not None else None)
+    if response_data:
+        if len(response_data) > DNS_FRAME_LIMIT:
+            # Raw sockets do not fragment; the client retries over TCP
+            response_data = truncate(response_data)
+        reply_socket.sendto(build_udp_packet(dst, src, dport, sport, response_data), (client_ip, 0))
+        query_log.info("Forwarded DNS response to %s", client_ip)
+    else:
+        logging.error("Failed to receive DNS response from server for query %s", question[0])
+
+def attach_filter(sock, program):
+    """Attach a classic BPF program, a list of (code, jt, jf, k), to sock. The kernel copies it, so nothing has to be kept alive."""
+    instructions = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *instruction) for instruction in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HP', len(program), ctypes.addressof(instructions)))
+
+class FrameSniffer:
+    """
+    Sniff mode's capture: an AF_PACKET socket on interface (every interface if empty) with the DNS query
+    filter attached, so each frame arrives as plain bytes for handle_frame() and nothing is dissected.
+    Like a packet capture it puts the interfaces in promiscuous mode, which lasts as long as the socket.
+    """
+    def __init__(self, interface=dns_sniff_interface, promiscuous=True):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        attach_filter(self.sock, DNS_QUERY_FILTER)
+        if interface:
+            self.sock.bind((interface, 0))
+        if promiscuous:
+            indexes = [socket.if_nametoindex(interface)] if interface else [index for index, name in socket.if_nameindex() if name != 'lo']
+            for index in indexes:
+                self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, struct.pack('iHH8s', index, PACKET_MR_PROMISC, 0, b''))
+
+    def recv(self):
+        """Return the next DNS query frame received on the sniffed interfaces; frames we send are skipped."""
+        while True:
+            frame, addr = self.sock.recvfrom(FRAME_BUFFER_SIZE)
+            if addr[2] != PACKET_OUTGOING:
+                return frame
+
+    def serve_forever(self, handler=handle_frame):
+        while True:
+            frame = self.recv()
+            try:
+                handler(frame)
+            except Exception:
+                logging.exception("Failed to answer a sniffed DNS query")
+
+class DNSForwarder:
+    """
+    Socket mode: a UDP DNS server bound to port 53 (iptables redirects clients' queries to it). Each query
+    is resolved on a thread pool, so one slow upstream answer only delays its own client.
+
+    With batch_size above 1, datagrams are read up to batch_size per recvmmsg() call. Queries in a batch
+    that can be answered without going upstream (local names, cache hits, portal answers for clients
+    whose approval is cached) are answered on the receiving thread and their replies go out together
+    with one sendmmsg(); only the rest, approval checks included, are handed to the thread pool.
+    """
+    def __init__(self, host='0.0.0.0', port=53, resolver=None, workers=dns_workers, batch_size=dns_batch_size, reuse_port=False):
+        self.resolver = make_resolver() if resolver is None else resolver
+        self.neighbors = neighbors
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind((host, port))
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batch = BatchSocket(self.sock, batch_size, DNS_BUFFER_SIZE) if batch_size > 1 else None
+
+    def serve_forever(self, log_stats=True):
+        logging.info(f"DNS forwarder listening on {self.sock.getsockname()}")
+        if log_stats:
+            threading.Thread(target=self.resolver.log_stats_forever, daemon=True).start()
+        if self.batch is not None:
+            return self.serve_batches()
+        while True:
+            data, addr = self.sock.recvfrom(DNS_BUFFER_SIZE)
+            self.executor.submit(self.handle_query, data, addr)
+
+    def serve_batches(self):
+        while True:
+            replies = []
+            for data, addr in self.batch.recv():
+                question = self.parse(data, addr)
+                if question is None:
+                    continue
+                client_mac = self.client_mac(addr)
+                response = self.resolver.resolve(data, client_mac, upstream=False)
+                if isinstance(response, Miss):
+                    self.executor.submit(self.forward, data, addr, question, client_mac, response)
+                elif response:
+                    replies.append((response, addr))
+            if replies:
+                try:
+                    self.batch.send(replies)
+                except OSError as e:
+                    logging.error(f"Failed to send a batch of {len(replies)} DNS responses: {e}")
+
+    def parse(self, data, addr):
+        question = parse_question(data)
+        if question is None:
+            logging.warning(f"Dropping malformed DNS query from {addr[0]}")
+        else:
+            query_log.info("Received DNS query for %s from %s", question[0], addr[0])
+        return question
+
+    def client_mac(self, addr):
+        return self.neighbors.lookup(addr[0]) if self.resolver.approvals is not None else None
+
+    def handle_query(self, data, addr):
+        question = self.parse(data, addr)
+        if question is not None:
+            self.forward(data, addr, question, self.client_mac(addr))
+
+    def forward(self, data, addr, question, client_mac, miss=None):
+        if miss is not None:
+            response = self.resolver.resolve_miss(data, miss, client_mac)
+        else:
+            response = self.resolver.resolve(data, client_mac)
+        if response:
+            self.sock.sendto(response, addr)
+            query_log.info("Forwarded DNS response to %s", addr[0])
         else:
-            logging.error(f"Failed to receive DNS response from server for query {query_name}")
+            logging.error("Failed to receive DNS response from server for query %s", question[0])
+
+class DNSTCPServer:
+    """
+    DNS over TCP on port 53, for clients retrying a truncated answer and for zone-transfer sized responses.
+    Each connection is served by its own thread and may carry any number of length-prefixed queries
+    (RFC 7766), answered in order, until the client closes it or it sits idle for idle_timeout seconds.
+    """
+    def __init__(self, host='0.0.0.0', port=53, resolver=None, idle_timeout=dns_tcp_idle_timeout, reuse_port=False):
+        self.resolver = make_resolver() if resolver is None else resolver
+        self.neighbors = neighbors
+        self.idle_timeout = idle_timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+
+    def serve_forever(self):
+        logging.info(f"DNS TCP server listening on {self.sock.getsockname()}")
+        while True:
+            conn, addr = self.sock.accept()
+            threading.Thread(target=self.handle_connection, args=(conn, addr), daemon=True).start()
+
+    def handle_connection(self, conn, addr):
+        conn.settimeout(self.idle_timeout)
+        client_mac = self.neighbors.lookup(addr[0]) if self.resolver.approvals is not None else None
+        try:
+            with conn, conn.makefile('rb') as stream:
+                while True:
+                    data = read_message(stream)
+                    if data is None:
+                        break
+                    question = parse_question(data)
+                    if question is None:
+                        logging.warning(f"Closing DNS TCP connection from {addr[0]} after a malformed query")
+                        break
+                    query_log.info("Received DNS query for %s over TCP from %s", question[0], addr[0])
+                    response = self.resolver.resolve(data, client_mac, tcp=True)
+                    if response:
+                        conn.sendall(struct.pack('!H', len(response)) + response)
+                    else:
+                        logging.error("Failed to receive DNS response from server for query %s", question[0])
+        except OSError:
+            # Idle timeout or the client went away
+            pass
+
+class Supervisor:
+    """
+    Supervisor mode: forks processes socket-mode workers that all bind port 53 (UDP and TCP) with
+    SO_REUSEPORT, so the kernel spreads clients across them and every core can answer queries. Each
+    worker has its own resolver and answer cache; SIGHUP to the supervisor clears every worker's cache.
+    Workers send their statistics up a pipe and the supervisor logs the totals. A worker that dies is
+    restarted after restart_delay seconds.
+    """
+    def __init__(self, host='0.0.0.0', port=53, processes=dns_processes, stats_interval=dns_stats_interval, restart_delay=1):
+        self.host = host
+        self.port = port
+        self.processes = processes or os.cpu_count()
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.workers = {}
+        self.stats = {}
+        self.selector = selectors.DefaultSelector()
+
+    def start_worker(self, index):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                self.run_worker(index, write_fd)
+            finally:
+                os._exit(1)
+        os.close(write_fd)
+        self.workers[pid] = index
+        self.selector.register(read_fd, selectors.EVENT_READ, [pid, index, b''])
+        logging.info(f"Started DNS worker {index} (pid {pid})")
+
+    def run_worker(self, index, write_fd):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.selector.close()
+        # The log listener thread is not copied by fork() either
+        setup_logging(dns_server_log, 'dns')
+        # Threads do not survive fork(), so the worker builds its own resolver and upstream pool
+        worker_resolver = make_resolver()
+        # The handler runs on the main thread, which may be inside get() or put() holding the cache lock
+        signal.signal(signal.SIGHUP, lambda signum, frame: worker_resolver.cache.invalidate())
+        pipe = os.fdopen(write_fd, 'wb', buffering=0)
+        report = lambda stats: pipe.write(json.dumps({'worker': index, 'stats': stats}).encode() + b'\n')
+        threading.Thread(target=worker_resolver.log_stats_forever, args=(self.stats_interval, report), daemon=True).start()
+        tcp_server = DNSTCPServer(self.host, self.port, resolver=worker_resolver, reuse_port=True)
+        threading.Thread(target=tcp_server.serve_forever, daemon=True).start()
+        DNSForwarder(self.host, self.port, resolver=worker_resolver, reuse_port=True).serve_forever(log_stats=False)
+
+    def stop(self, signum=None, frame=None):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    def forward_signal(self, signum, frame):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def serve_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.forward_signal)
+        for index in range(self.processes):
+            self.start_worker(index)
+        next_log = time.time() + self.stats_interval
+        while True:
+            for key, _ in self.selector.select(max(0, next_log - time.time())):
+                data = os.read(key.fd, 65536)
+                if data:
+                    *lines, key.data[2] = (key.data[2] + data).split(b'\n')
+                    for line in lines:
+                        message = json.loads(line)
+                        self.stats[message['worker']] = message['stats']
+                    continue
+                # EOF: the worker has exited
+                pid, index, _ = key.data
+                self.selector.unregister(key.fd)
+                os.close(key.fd)
+                os.waitpid(pid, 0)
+                del self.workers[pid]
+                logging.error(f"DNS worker {index} (pid {pid}) exited, restarting it")
+                time.sleep(self.restart_delay)
+                self.start_worker(index)
+            if time.time() >= next_log:
+                next_log = time.time() + self.stats_interval
+                totals = {}
+                for stats in self.stats.values():
+                    for name, value in stats.items():
+                        totals[name] = totals.get(name, 0) + value
+                logging.info(f"DNS statistics ({len(self.stats)} workers): {totals}")
 
-# Start the DNS interceptor
-logging.info("DNS Interceptor setup complete. Starting packet sniffing...")
-sniff(filter="udp port 53", prn=dns_interceptor)
+if __name__ == '__main__':
+    # Usage: python3 dns_server.py [sniff|socket|supervisor]
+    mode = sys.argv[1] if len(sys.argv) > 1 else dns_mode
+    if mode == 'supervisor':
+        Supervisor().serve_forever()
+    # Built here rather than at import, so the supervisor never forks with the pool's threads running
+    resolver = make_resolver()
+    threading.Thread(target=DNSTCPServer(resolver=resolver).serve_forever, daemon=True).start()
+    if mode == 'socket':
+        DNSForwarder(resolver=resolver).serve_forever()
+    else:
+        # Start the DNS interceptor
+        reply_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+        sniffer = FrameSniffer()
+        logging.info("DNS Interceptor setup complete. Starting packet sniffing...")
+        threading.Thread(target=resolver.log_stats_forever, daemon=True).start()
+        sniffer.serve_forever()
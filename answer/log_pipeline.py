@@ -0,0 +1,90 @@
+import json
+import queue
+import atexit
+import logging
+import itertools
+import configparser
+from logging.handlers import QueueHandler, QueueListener
+
+config = configparser.ConfigParser()
+config.read('/home/mininet/Captive-Portal/config.ini')
+log_format = config['DEFAULT']['log_format']
+log_levels = config['DEFAULT']['log_levels']
+log_sample = config['DEFAULT']['log_sample']
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Attributes every LogRecord has; anything else on a record came from extra= and is written as a field
+RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+def parse_pairs(value):
+    """Parse 'name=value,name=value' into a dict."""
+    pairs = {}
+    for entry in value.split(','):
+        if '=' in entry:
+            name, setting = entry.split('=', 1)
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger and message, plus any fields passed with extra=."""
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are, so the message is only formatted on the listener thread. The stock
+    QueueHandler formats in the caller's thread; here only a traceback is rendered there, because the
+    frames it refers to may be gone by the time the listener gets to it.
+    """
+    def prepare(self, record):
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Lets through one record in every rate, for events too frequent to log each time."""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        # itertools.count is advanced atomically under the GIL
+        return next(self.counter) % self.rate == 0
+
+listener = None
+
+def setup_logging(filename, component):
+    """
+    Send this process's logging through a queue to a background thread that writes filename, so a log
+    call costs the caller an enqueue instead of a formatted, synchronous file write. The root level is
+    log_levels' entry for component; entries named component.<event> set the level of that logger, and
+    log_sample entries let through one in every N of its records. Calling it again (e.g. in a forked
+    child, which has no listener thread) replaces the previous pipeline.
+    """
+    global listener
+    handler = logging.FileHandler(filename)
+    handler.setFormatter(JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [LazyQueueHandler(records)]
+    levels = parse_pairs(log_levels)
+    root.setLevel(levels.get(component, 'INFO').upper())
+    for name, level in levels.items():
+        if name.startswith(component + '.'):
+            logging.getLogger(name).setLevel(level.upper())
+    for name, rate in parse_pairs(log_sample).items():
+        if name.startswith(component + '.') and int(rate) > 1:
+            logging.getLogger(name).filters = [SamplingFilter(int(rate))]
+    if listener is None:
+        atexit.register(lambda: listener.stop())
+    listener = QueueListener(records, handler)
+    listener.start()
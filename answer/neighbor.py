@@ -0,0 +1,72 @@
+import time
+import threading
+
+class NeighborCache:
+    """
+    IP -> MAC lookups answered from the kernel neighbor table (/proc/net/arp) instead of an ARP probe.
+    The table is re-read when it is older than ttl seconds, or on a miss at most every miss_interval seconds.
+    """
+    def __init__(self, ttl=5, miss_interval=0.5, path='/proc/net/arp'):
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self.path = path
+        self.table = {}
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def reload(self):
+        table = {}
+        try:
+            with open(self.path) as f:
+                next(f)  # Header
+                for line in f:
+                    fields = line.split()
+                    # Only complete entries (ATF_COM) carry a usable hardware address
+                    if len(fields) >= 4 and int(fields[2], 16) & 0x2 and fields[3] != '00:00:00:00:00:00':
+                        table[fields[0]] = fields[3].lower()
+        except (OSError, StopIteration, ValueError):
+            pass
+        self.table = table
+        self.loaded_at = time.time()
+
+    def lookup(self, ip):
+        """Return the MAC address for ip, or None if the kernel does not know it."""
+        loaded_at = self.loaded_at
+        age = time.time() - loaded_at
+        mac = self.table.get(ip)
+        if age > self.ttl or (mac is None and age > self.miss_interval):
+            with self.lock:
+                # Another thread may have reloaded while we waited
+                if self.loaded_at == loaded_at:
+                    self.reload()
+            mac = self.table.get(ip)
+        return mac
+
+class MACResolver:
+    """
+    IP -> MAC with active probing as the last resort: the kernel neighbor table first, then addresses
+    learned by earlier probes (remembered for ttl seconds), and only then probe(ip), which should send
+    an ARP request and return the MAC address or None.
+    """
+    def __init__(self, probe=None, ttl=60, neighbors=None):
+        self.probe = probe
+        self.ttl = ttl
+        self.neighbors = NeighborCache() if neighbors is None else neighbors
+        self.learned = {}
+        self.probes = 0
+
+    def resolve(self, ip):
+        """Return the MAC address for ip, or None if it could not be found."""
+        mac = self.neighbors.lookup(ip)
+        if mac is not None:
+            return mac
+        entry = self.learned.get(ip)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        if self.probe is None:
+            return None
+        self.probes += 1
+        mac = self.probe(ip)
+        if mac is not None:
+            self.learned[ip] = (mac, time.time() + self.ttl)
+        return mac
@@ -14,6 +14,7 @@ internet_ip = config['DEFAULT']['internet_ip']
 internet_mac = config['DEFAULT']['internet_mac']
 captive_portal_ip = config['DEFAULT']['captive_portal_ip']
 captive_portal_mac = config['DEFAULT']['captive_portal_mac']
+dns_mode = config['DEFAULT']['dns_mode']
 
 bash_script = f'''#!/bin/bash
 
@@ -58,6 +59,9 @@ def configure_network(host):
 
 def configure_host_network(host):
     host.cmd('iptables -t nat -A PREROUTING -p tcp --dport 53 -j REDIRECT --to-port 53')
+    if dns_mode in ('socket', 'supervisor'):
+        # The socket-mode DNS forwarder answers on port 53 itself instead of sniffing
+        host.cmd('iptables -t nat -A PREROUTING -p udp --dport 53 -j REDIRECT --to-port 53')
     host.cmd('iptables -t nat -A PREROUTING -p tcp --dport 80 -j REDIRECT --to-port 80')
     host.cmd('iptables -t nat -A PREROUTING -p tcp --dport 443 -j REDIRECT --to-port 443')
 
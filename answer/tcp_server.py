@@ -1,10 +1,16 @@
+import os
+import sys
 import json
+import time
+import string
 import atexit
 import socket
+import asyncio
 import logging
 import threading
-from datetime import datetime, timedelta
 import configparser
+from array import array
+from log_pipeline import setup_logging
 
 config = configparser.ConfigParser()
 config.read('/home/mininet/Captive-Portal/config.ini')
@@ -13,66 +19,546 @@ TCP_server_port = int(config['DEFAULT']['TCP_server_port'])
 captive_portal_mac = config['DEFAULT']['captive_portal_mac']
 internet_mac = config['DEFAULT']['internet_mac']
 server_log = config['DEFAULT']['server_log']
+subscriber_timeout = float(config['DEFAULT']['subscriber_timeout'])
+server_mode = config['DEFAULT']['server_mode']
+valid_time = float(config['DEFAULT']['valid_time'])
+expiry_interval = float(config['DEFAULT']['expiry_interval'])
+journal_file = config['DEFAULT']['journal_file']
+snapshot_file = config['DEFAULT']['snapshot_file']
+journal_fsync = config['DEFAULT']['journal_fsync']
+journal_fsync_interval = float(config['DEFAULT']['journal_fsync_interval'])
+snapshot_interval = float(config['DEFAULT']['snapshot_interval'])
 
-# Setup logging
-logging.basicConfig(filename=server_log, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Setup logging; every request is logged to its own logger so it can be sampled or silenced
+setup_logging(server_log, 'server')
+request_log = logging.getLogger('server.request')
 
-valid_time = timedelta(days=1)
+# Longest message either server mode will buffer while looking for the end of a line
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+# Bytes queued for a slow asyncio subscriber before it is dropped
+SUBSCRIBER_BUFFER_LIMIT = 1024 * 1024
+# Commands that take Server.lock and may write the journal; the asyncio server runs them off the event loop
+WRITE_COMMANDS = {'setHost', 'setInternet', 'add', 'remove', 'addMany'}
+
+MAC_MASK = (1 << 48) - 1
+
+def mac_to_int(mac):
+    """
+    Normalize a MAC address to a 48-bit integer. Accepts any case and the usual notations
+    (00:00:5e:00:53:01, 00-00-5E-00-53-01, 0:0:5e:0:53:1, 0000.5e00.5301, 00005e005301).
+    """
+    if isinstance(mac, int) and not isinstance(mac, bool) and 0 <= mac <= MAC_MASK:
+        return mac
+    if not isinstance(mac, str):
+        raise ValueError(f"Invalid MAC address: {mac!r}")
+    parts = mac.strip().replace('-', ':').split(':')
+    if len(parts) == 6:
+        digits = ''.join(part.zfill(2) for part in parts)
+    else:
+        digits = mac.strip().replace('.', '')
+    if len(digits) != 12 or not all(c in string.hexdigits for c in digits):
+        raise ValueError(f"Invalid MAC address: {mac!r}")
+    return int(digits, 16)
+
+def int_to_mac(mac):
+    """Format a 48-bit integer as a canonical lower-case MAC address."""
+    digits = f"{mac:012x}"
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+def fsync_directory(path):
+    """fsync the directory holding path, so a rename or unlink in it survives a crash."""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def now_ms():
+    return int(time.time() * 1000)
+
+class MACTable:
+    """
+    Open-addressing hash table from 48-bit MAC integers to session end times in integer milliseconds. Keys
+    and expiry times live in two array('Q') columns, 16 bytes per slot, instead of a dict of str/datetime
+    objects. A slot key is mac + 1, so 0 marks an empty slot; TOMBSTONE marks a deleted one.
+
+    Writers must be serialized. get() is safe without a lock: it reads the (keys, expiries, mask) tuple
+    once, so a concurrent resize is never seen half done, and set() writes the expiry before the key.
+    """
+    TOMBSTONE = 1 << 63
+
+    def __init__(self, capacity=1024, keys=None, expiries=None):
+        if keys is None:
+            keys = array('Q', bytes(8 * capacity))
+            expiries = array('Q', bytes(8 * capacity))
+        self.slots = (keys, expiries, len(keys) - 1)
+        self.used = len(keys) - keys.count(0)
+        self.size = self.used - keys.count(self.TOMBSTONE)
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def slot(mac, mask):
+        # Fibonacci hashing spreads sequential vendor-prefixed MACs across the table
+        return ((mac * 0x9E3779B97F4A7C15) >> 16) & mask
+
+    def get(self, mac):
+        """Return the expiry time of mac, or None if it is not in the table."""
+        keys, expiries, mask = self.slots
+        key = mac + 1
+        i = self.slot(mac, mask)
+        while True:
+            k = keys[i]
+            if k == key:
+                return expiries[i]
+            if not k:
+                return None
+            i = (i + 1) & mask
+
+    def set(self, mac, expires_at):
+        keys, expiries, mask = self.slots
+        key = mac + 1
+        i = self.slot(mac, mask)
+        free = None
+        while True:
+            k = keys[i]
+            if k == key:
+                expiries[i] = expires_at
+                return
+            if not k:
+                break
+            if k == self.TOMBSTONE and free is None:
+                free = i
+            i = (i + 1) & mask
+        if free is None:
+            free = i
+            self.used += 1
+        expiries[free] = expires_at
+        keys[free] = key
+        self.size += 1
+        # Keep probe sequences short: grow at 70% occupancy (tombstones included), rehashing drops tombstones
+        if self.used * 10 > len(keys) * 7:
+            self.resize(len(keys) * 2 if self.size * 10 > len(keys) * 4 else len(keys))
+
+    def delete(self, mac):
+        """Remove mac and return whether it was present."""
+        keys, expiries, mask = self.slots
+        key = mac + 1
+        i = self.slot(mac, mask)
+        while True:
+            k = keys[i]
+            if k == key:
+                keys[i] = self.TOMBSTONE
+                self.size -= 1
+                return True
+            if not k:
+                return False
+            i = (i + 1) & mask
+
+    def resize(self, capacity):
+        table = MACTable(capacity)
+        for mac, expires_at in self.items():
+            table.set(mac, expires_at)
+        self.slots = table.slots
+        self.size = table.size
+        self.used = table.used
+
+    def items(self):
+        """Yield (mac, expires_at) for every entry."""
+        keys, expiries, _ = self.slots
+        for i, key in enumerate(keys):
+            if key and key != self.TOMBSTONE:
+                yield key - 1, expiries[i]
+
+    def copy(self):
+        """Return a copy of the raw (keys, expiries) columns, e.g. to snapshot them outside the lock."""
+        keys, expiries, _ = self.slots
+        return array('Q', keys), array('Q', expiries)
+
+class MACJournal:
+    """
+    Crash-safe storage for approved MACs: an append-only journal of every add ("+ mac expires_at") and
+    remove ("- mac"), with MACs in hex and times in milliseconds, periodically compacted into a snapshot
+    holding the raw MACTable columns, so restoring it is two array reads with no rehashing. Expiry is not
+    journaled since lapsed sessions are dropped on load. fsync is 'always' (every append), 'interval'
+    (whenever sync() runs) or 'never' (left to the OS).
+    """
+    def __init__(self, journal_file=journal_file, snapshot_file=snapshot_file, fsync=journal_fsync):
+        self.journal_file = journal_file
+        self.snapshot_file = snapshot_file
+        self.rotated_file = journal_file + '.old'
+        self.fsync = fsync
+        self.file = None
+        self.file_lock = threading.Lock()
+        self.dirty = False
+        self.records = 0
+
+    def open(self):
+        """
+        Restore the MACTable from disk and reopen the journal for appending. Lapsed sessions are left
+        for MACSet.expire() to evict, and compaction is left to the next scheduled snapshot.
+        """
+        start = time.time()
+        table = MACTable()
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'rb') as f:
+                slots = os.fstat(f.fileno()).st_size // 16
+                keys = array('Q')
+                keys.fromfile(f, slots)
+                expiries = array('Q')
+                expiries.fromfile(f, slots)
+            table = MACTable(keys=keys, expiries=expiries)
+        # A leftover rotated journal means the last compaction did not finish
+        for path in (self.rotated_file, self.journal_file):
+            if os.path.exists(path):
+                self.records += self.replay(path, table)
+        logging.info(f"Restored {len(table)} MAC(s) in {time.time() - start:.3f}s")
+        self.file = open(self.journal_file, 'a')
+        return table
+
+    def replay(self, path, table):
+        """Apply the records in path to table and return how many lines were read."""
+        count = 0
+        with open(path) as f:
+            for line in f:
+                count += 1
+                fields = line.split()
+                # The last line may be torn if we crashed mid-write
+                try:
+                    if len(fields) == 3 and fields[0] == '+':
+                        table.set(int(fields[1], 16), int(fields[2]))
+                    elif len(fields) == 2 and fields[0] == '-':
+                        table.delete(int(fields[1], 16))
+                except ValueError:
+                    pass
+        return count
+
+    def append(self, lines):
+        with self.file_lock:
+            self.file.write(''.join(lines))
+            self.file.flush()
+            if self.fsync == 'always':
+                os.fsync(self.file.fileno())
+            else:
+                self.dirty = True
+            self.records += len(lines)
+
+    def record_adds(self, macs, expires_at):
+        self.append([f"+ {mac:012x} {expires_at}\n" for mac in macs])
+
+    def record_remove(self, mac):
+        self.append([f"- {mac:012x}\n"])
+
+    def sync(self):
+        """Flush appended records to disk under the 'interval' policy."""
+        with self.file_lock:
+            if self.dirty and self.fsync == 'interval':
+                os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def rotate(self):
+        """Move the journal aside and start a new one. Call with writers stopped, then write_snapshot()."""
+        with self.file_lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            if os.path.exists(self.rotated_file):
+                # The previous snapshot never landed, so keep its records ahead of ours
+                with open(self.rotated_file, 'a') as rotated, open(self.journal_file) as current:
+                    rotated.write(current.read())
+                    # The records must be on disk in their new home before the old one goes
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, self.rotated_file)
+            self.file = open(self.journal_file, 'w')
+            fsync_directory(self.journal_file)
+            self.dirty = False
+            self.records = 0
+
+    def write_snapshot(self, columns):
+        """Atomically replace the snapshot with MACTable columns, then drop the rotated journal they cover."""
+        keys, expiries = columns
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            keys.tofile(f)
+            expiries.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        # Make the new snapshot durable before dropping the journal it replaces
+        fsync_directory(self.snapshot_file)
+        if os.path.exists(self.rotated_file):
+            os.remove(self.rotated_file)
+
+    def close(self):
+        with self.file_lock:
+            if self.file:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
 
 class MACSet:
-    def __init__(self):
-        self.approved_macs = {}
+    """
+    Approved MAC addresses, built for read-mostly access. Writers are serialized by the caller (Server.lock),
+    while check_mac never locks: MACTable.get() is safe against a concurrent writer, so concurrent checks
+    neither contend with each other nor wait behind an add.
+
+    MACs are 48-bit integers (see mac_to_int) mapped to the time their session ends. The expiry index is
+    a timer wheel: expiry_wheel maps each bucket_ms-wide slice of time to an array('Q') of the MACs whose
+    session ends in it, 8 bytes per entry, so expire() only visits the buckets that are due. Entries
+    superseded by a re-add or remove are skipped there, since the table no longer agrees with them.
+    """
+    def __init__(self, valid_time=valid_time, journal=None, bucket=expiry_interval):
+        self.valid_time = int(valid_time * 1000)
+        self.journal = journal
+        self.table = MACTable()
+        self.bucket_ms = max(int(bucket * 1000), 1)
+        self.expiry_wheel = {}
+        self.scheduled = 0
+
+    def restore(self, table):
+        """Replace the contents with table, e.g. as loaded by MACJournal.open()."""
+        self.table = table
+        self.rebuild_wheel()
+
+    def rebuild_wheel(self):
+        wheel = {}
+        bucket_ms = self.bucket_ms
+        for mac, expires_at in self.table.items():
+            wheel.setdefault(expires_at // bucket_ms, []).append(mac)
+        self.expiry_wheel = {bucket: array('Q', macs) for bucket, macs in wheel.items()}
+        self.scheduled = len(self.table)
+
+    def schedule(self, mac, expires_at):
+        bucket = expires_at // self.bucket_ms
+        macs = self.expiry_wheel.get(bucket)
+        if macs is None:
+            macs = self.expiry_wheel[bucket] = array('Q')
+        macs.append(mac)
+        self.scheduled += 1
+
+    def add_macs(self, macs):
+        expires_at = now_ms() + self.valid_time
+        for mac in macs:
+            self.table.set(mac, expires_at)
+            self.schedule(mac, expires_at)
+        # Repeated logins leave stale wheel entries behind; rebuild before they dominate it
+        if self.scheduled > 2 * len(self.table) + 1024:
+            self.rebuild_wheel()
+        if self.journal:
+            self.journal.record_adds(macs, expires_at)
+        return [True] * len(macs)
 
     def add_mac(self, mac):
-        self.approved_macs[mac] = datetime.now()
-        return True
+        return self.add_macs([mac])[0]
 
     def remove_mac(self, mac):
-        if mac in self.approved_macs:
-            del self.approved_macs[mac]
-            logging.info(f"Mac {mac} removed.")
+        if self.table.delete(mac):
+            if self.journal:
+                self.journal.record_remove(mac)
+            logging.info(f"Mac {int_to_mac(mac)} removed.")
             return True
         else:
-            logging.info(f"Mac {mac} not found.")
+            logging.info(f"Mac {int_to_mac(mac)} not found.")
             return False
 
     def check_mac(self, mac):
-        if mac in self.approved_macs:
-            logging.info(f"Mac {mac} is approved, added on {self.approved_macs[mac]}. {datetime.now()-self.approved_macs[mac] < valid_time}")
+        expires_at = self.table.get(mac)
+        if expires_at is not None and expires_at > now_ms():
+            logging.debug("Mac %012x is approved until %d.", mac, expires_at)
             return True
         else:
-            logging.info(f"Mac {mac} is not approved.")
+            logging.debug("Mac %012x is not approved.", mac)
             return False
 
+    def expire(self, now=None):
+        """Evict every session that has ended and return the evicted MACs."""
+        now = now_ms() if now is None else now
+        expired = []
+        for bucket in sorted(bucket for bucket in self.expiry_wheel if bucket <= now // self.bucket_ms):
+            macs = self.expiry_wheel.pop(bucket)
+            self.scheduled -= len(macs)
+            pending = array('Q')
+            for mac in macs:
+                expires_at = self.table.get(mac)
+                if expires_at is None or expires_at // self.bucket_ms != bucket:
+                    continue
+                if expires_at <= now:
+                    self.table.delete(mac)
+                    expired.append(mac)
+                else:
+                    # The current bucket is only partly due
+                    pending.append(mac)
+            if pending:
+                self.expiry_wheel[bucket] = pending
+                self.scheduled += len(pending)
+        return expired
+
+class AsyncSubscriber:
+    """Gives an asyncio StreamWriter the sendall/close interface publish() uses for subscriber sockets."""
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def sendall(self, data):
+        if self.writer.transport.get_write_buffer_size() > SUBSCRIBER_BUFFER_LIMIT:
+            raise OSError('Subscriber is not keeping up')
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
 class Server:
-    def __init__(self, hMAC=captive_portal_mac, iMAC=internet_mac, host=TCP_server_ip, port=TCP_server_port):
+    def __init__(self, hMAC=captive_portal_mac, iMAC=internet_mac, host=TCP_server_ip, port=TCP_server_port, journal_file=journal_file):
         self.host = host
         self.port = port
-        self.hMAC = hMAC
-        self.iMAC = iMAC
-        self.MACSet = MACSet()
+        self.hMAC = int_to_mac(mac_to_int(hMAC))
+        self.iMAC = int_to_mac(mac_to_int(iMAC))
+        # An empty journal_file keeps approvals in memory only
+        self.journal = MACJournal(journal_file) if journal_file else None
+        self.MACSet = MACSet(journal=self.journal)
+        if self.journal:
+            self.MACSet.restore(self.journal.open())
+        self.last_snapshot = time.time()
         self.server_socket = None
         self.lock = threading.Lock()
         self.stop_event = threading.Event()
+        self.subscribers = []
+        self.loop = None
+        self.async_server = None
+
+    def parse_request(self, line):
+        """Decode one line of the protocol, returning None if it is not a JSON object."""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            # JSONDecodeError, or UnicodeDecodeError for a line that is not UTF-8
+            return None
+        if not isinstance(request, dict):
+            return None
+        request_log.info("Received message: %s", request)
+        return request
+
+    def respond(self, request):
+        """Serve a parsed request and return the encoded response line."""
+        if request is None:
+            response = {'error': 'Invalid JSON'}
+        else:
+            response = self.handle_request(request)
+            if 'id' in request:
+                response['id'] = request['id']
+        return (json.dumps(response) + '\n').encode()
     
     def handle_client(self, conn, addr):
         logging.info(f'Connected by: {addr}')
         try:
+            # Messages are newline-delimited JSON, so pipelined requests can be parsed as they stream in
+            stream = conn.makefile('rb')
             while True:
-                data = conn.recv(1024).decode()
-                if not data:
+                line = stream.readline(MAX_MESSAGE_SIZE)
+                if not line:
                     break
-                try:
-                    request = json.loads(data)
-                    logging.info(f"Received message: {request}")
-                    response = self.handle_request(request)
-                    conn.sendall(json.dumps(response).encode())
-                except json.JSONDecodeError:
-                    response = {'error': 'Invalid JSON'}
-                    conn.sendall(json.dumps(response).encode())
+                if len(line) == MAX_MESSAGE_SIZE and not line.endswith(b'\n'):
+                    # Same limit as the asyncio mode, which drops the connection too
+                    logging.warning(f'Closing connection from {addr}: message longer than {MAX_MESSAGE_SIZE} bytes')
+                    break
+                request = self.parse_request(line)
+                if request is not None and request.get('command') == 'subscribe':
+                    self.subscribe(conn, addr)
+                    break
+                conn.sendall(self.respond(request))
+        except OSError:
+            pass
         finally:
             conn.close()
 
+    async def handle_client_async(self, reader, writer):
+        """asyncio counterpart of handle_client, serving one connection on the event loop. Writes run on the default executor."""
+        addr = writer.get_extra_info('peername')
+        logging.info(f'Connected by: {addr}')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = self.parse_request(line)
+                if request is not None and request.get('command') == 'subscribe':
+                    await self.subscribe_async(reader, writer, addr)
+                    break
+                if request is not None and request.get('command') in WRITE_COMMANDS:
+                    # The lock can be held through a journal compaction, and an fsync may follow the write
+                    response = await self.loop.run_in_executor(None, self.respond, request)
+                else:
+                    response = self.respond(request)
+                writer.write(response)
+                await writer.drain()
+        except (OSError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def subscribe_async(self, reader, writer, addr):
+        """asyncio counterpart of subscribe."""
+        subscriber = AsyncSubscriber(self.loop, writer)
+        with self.lock:
+            subscriber.sendall((json.dumps({'result': True}) + '\n').encode())
+            self.subscribers.append(subscriber)
+        logging.info(f"Subscriber {addr} registered.")
+        try:
+            while await reader.read(1024):
+                pass
+        finally:
+            with self.lock:
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+            logging.info(f"Subscriber {addr} disconnected.")
+
+    def subscribe(self, conn, addr):
+        """
+        Turn conn into an event stream. Every later change is pushed to it as one JSON object per line
+        until the subscriber disconnects; requests are no longer served on this connection.
+        """
+        conn.settimeout(subscriber_timeout)
+        with self.lock:
+            conn.sendall((json.dumps({'result': True}) + '\n').encode())
+            self.subscribers.append(conn)
+        logging.info(f"Subscriber {addr} registered.")
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    if not conn.recv(1024):
+                        break
+                except socket.timeout:
+                    continue
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if conn in self.subscribers:
+                    self.subscribers.remove(conn)
+            logging.info(f"Subscriber {addr} disconnected.")
+
+    def publish(self, event, value):
+        """Push an event to every subscriber. Called with self.lock held so events arrive in the order applied."""
+        self.publish_many(event, [value])
+
+    def publish_many(self, event, values):
+        """Push one event per value, written to each subscriber in a single send."""
+        if not self.subscribers or not values:
+            return
+        message = ''.join(json.dumps({'event': event, 'value': value}) + '\n' for value in values).encode()
+        for conn in list(self.subscribers):
+            try:
+                conn.sendall(message)
+            except OSError:
+                logging.info("Dropping unresponsive subscriber.")
+                self.subscribers.remove(conn)
+                conn.close()
+
     def run_tcp_server(self):
         """Runs a TCP server that stays open even if the client disconnects."""
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -80,39 +566,129 @@ class Server:
             s.bind((self.host, self.port))
             s.listen()
             logging.info(f"Server listening on {self.host}:{self.port}")
+            self.start_expiry_thread()
+            self.start_persistence_thread()
             while not self.stop_event.is_set():  # Stay open forever
                 conn, addr = s.accept()
                 client_thread = threading.Thread(target=self.handle_client, args=(conn, addr))
                 client_thread.start()
     
-    def get_host(self):
+    def start_expiry_thread(self):
+        """Evict lapsed sessions every expiry_interval seconds until the server stops."""
+        def expire_loop():
+            while not self.stop_event.wait(expiry_interval):
+                self.expire_macs()
+        threading.Thread(target=expire_loop, daemon=True).start()
+
+    def expire_macs(self):
+        with self.lock:
+          expired = [int_to_mac(mac) for mac in self.MACSet.expire()]
+          self.publish_many('expire', expired)
+        if expired:
+            logging.info(f"Expired {len(expired)} MAC(s): {expired}")
+        return expired
+
+    def start_persistence_thread(self):
+        """Sync the journal every journal_fsync_interval seconds and compact it every snapshot_interval."""
+        if not self.journal:
+            return
+        def persistence_loop():
+            while not self.stop_event.wait(journal_fsync_interval):
+                self.journal.sync()
+                if self.journal.records and time.time() - self.last_snapshot >= snapshot_interval:
+                    self.compact_journal()
+        threading.Thread(target=persistence_loop, daemon=True).start()
+
+    def compact_journal(self):
+        """Fold the journal into a new snapshot. Only the copy and rotation hold the lock."""
         with self.lock:
-          return {'result': self.hMAC}
+            columns = self.MACSet.table.copy()
+            self.journal.rotate()
+        self.journal.write_snapshot(columns)
+        self.last_snapshot = time.time()
+        logging.info(f"Compacted journal into a snapshot of {len(self.MACSet.table)} MAC(s)")
+
+    def run_async_server(self):
+        """Serves the same commands as run_tcp_server on a single asyncio event loop instead of a thread per connection."""
+        asyncio.run(self.serve_async())
+
+    async def serve_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.async_server = await asyncio.start_server(self.handle_client_async, self.host, self.port, limit=MAX_MESSAGE_SIZE)
+        logging.info(f"Server listening on {self.host}:{self.port} (asyncio)")
+        self.start_expiry_thread()
+        self.start_persistence_thread()
+        async with self.async_server:
+            try:
+                await self.async_server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def run(self, mode=server_mode):
+        """Runs the server in 'threaded' or 'asyncio' mode."""
+        if mode == 'asyncio':
+            self.run_async_server()
+        else:
+            self.run_tcp_server()
+    
+    def get_host(self):
+        return {'result': self.hMAC}
     
     def set_host(self, value):
+        value = int_to_mac(mac_to_int(value))
         with self.lock:
           self.hMAC = value
+          self.publish('setHost', value)
           return {'result': True}
     
     def get_internet(self):
-        with self.lock:
-          return {'result': self.iMAC}
+        return {'result': self.iMAC}
     
     def set_internet(self, value):
+        value = int_to_mac(mac_to_int(value))
         with self.lock:
           self.iMAC = value
+          self.publish('setInternet', value)
           return {'result': True}
     
+    # MACs arrive in any notation; they are stored as integers and published in canonical form
     def add_mac(self, value):
+        mac = mac_to_int(value)
+        with self.lock:
+          result = self.MACSet.add_mac(mac)
+          self.publish('add', int_to_mac(mac))
+          return {'result': result}
+    
+    def remove_mac(self, value):
+        mac = mac_to_int(value)
         with self.lock:
-          return {'result': self.MACSet.add_mac(value)}
+          result = self.MACSet.remove_mac(mac)
+          if result:
+            self.publish('remove', int_to_mac(mac))
+          return {'result': result}
     
+    # Reads are lock-free, see MACSet
     def check_mac(self, value):
+        return {'result': self.MACSet.check_mac(mac_to_int(value))}
+
+    def add_macs(self, values):
+        macs = [mac_to_int(value) for value in values]
         with self.lock:
-          return {'result': self.MACSet.check_mac(value)}
+          results = self.MACSet.add_macs(macs)
+          self.publish_many('add', [int_to_mac(mac) for mac in macs])
+          return {'result': results}
+
+    def check_macs(self, values):
+        return {'result': [self.MACSet.check_mac(mac_to_int(value)) for value in values]}
 
     def handle_request(self, request):
         """Handle incoming requests and return a response."""
+        try:
+            return self.dispatch(request)
+        except ValueError as e:
+            return {'error': str(e)}
+
+    def dispatch(self, request):
         command = request.get('command')
         response = {'error': 'Invalid command'}
         if command == 'getHost':
@@ -125,18 +701,38 @@ class Server:
             response = self.set_internet(request.get('value'))
         elif command == 'add':
             response = self.add_mac(request.get('value'))
+        elif command == 'remove':
+            response = self.remove_mac(request.get('value'))
         elif command == 'check':
             response = self.check_mac(request.get('value'))
+        elif command in ('addMany', 'checkMany'):
+            values = request.get('value')
+            if not isinstance(values, list):
+                response = {'error': 'Expected a list of MAC addresses'}
+            elif command == 'addMany':
+                response = self.add_macs(values)
+            else:
+                response = self.check_macs(values)
         return response
 
     def stop_server(self):
         """Stops the TCP server."""
         logging.info("Stopping server...")
         self.stop_event.set()
+        with self.lock:
+            for conn in self.subscribers:
+                conn.close()
+            self.subscribers.clear()
         if self.server_socket:
             self.server_socket.close()
+        if self.async_server:
+            self.loop.call_soon_threadsafe(self.async_server.close)
+        if self.journal:
+            with self.lock:
+                self.journal.close()
 
 if __name__ == '__main__':
     server = Server()
-    server.run_tcp_server()
-    atexit.register(server.stop_server())
+    atexit.register(server.stop_server)
+    # Usage: python3 tcp_server.py [threaded|asyncio]
+    server.run(sys.argv[1] if len(sys.argv) > 1 else server_mode)
@@ -1,12 +1,33 @@
+import os
 import ssl
+import gzip
 import json
+import time
+import socket
+import select
+import hashlib
+import functools
 import atexit
 import logging
 import threading
 import configparser
 from urllib.parse import parse_qs
+from email.utils import formatdate, parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, SimpleHTTPRequestHandler
-from scapy.all import ARP, Ether, srp
+from log_pipeline import setup_logging
+from neighbor import MACResolver, NeighborCache
+
+try:
+    from scapy.all import ARP, Ether, srp
+except ImportError:
+    # Without scapy, clients' MAC addresses cannot be resolved by ARP
+    srp = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 config = configparser.ConfigParser()
 config.read('/home/mininet/Captive-Portal/config.ini')
@@ -17,9 +38,24 @@ keyfile = config['DEFAULT']['keyfile']
 certfile = config['DEFAULT']['certfile']
 captive_portal_host = config['DEFAULT']['captive_portal_host']
 web_server_log = config['DEFAULT']['web_server_log']
+web_workers = int(config['DEFAULT']['web_workers'])
+web_request_timeout = float(config['DEFAULT']['web_request_timeout'])
+web_keepalive_timeout = float(config['DEFAULT']['web_keepalive_timeout'])
+web_static_reload = config['DEFAULT']['web_static_reload']
+web_static_reload_interval = float(config['DEFAULT']['web_static_reload_interval'])
+neighbor_cache_ttl = float(config['DEFAULT']['neighbor_cache_ttl'])
+arp_probe_cache_ttl = float(config['DEFAULT']['arp_probe_cache_ttl'])
+web_auth_pool_size = int(config['DEFAULT']['web_auth_pool_size'])
+web_auth_timeout = float(config['DEFAULT']['web_auth_timeout'])
+web_auth_health_interval = float(config['DEFAULT']['web_auth_health_interval'])
+web_auth_backoff = float(config['DEFAULT']['web_auth_backoff'])
+web_auth_backoff_max = float(config['DEFAULT']['web_auth_backoff_max'])
+web_auth_breaker_threshold = int(config['DEFAULT']['web_auth_breaker_threshold'])
+web_auth_breaker_reset = float(config['DEFAULT']['web_auth_breaker_reset'])
 
-# Setup logging
-logging.basicConfig(filename=web_server_log, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Setup logging; per-request events go to their own logger so they can be sampled or silenced
+setup_logging(web_server_log, 'web')
+request_log = logging.getLogger('web.request')
 
 httpd = None
 httpsd = None
@@ -28,18 +64,49 @@ protocol = 'http'
 if (ssl_enable == 'True'):
     protocol = 'https'
 
+# Requests sent before waiting for their responses
+PIPELINE_WINDOW = 256
+
+WEB_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web')
+MIME_TYPES = {'.html': 'text/html', '.css': 'text/css', '.js': 'application/javascript'}
+
 class TCPClient:
-  def __init__(self, host=TCP_server_ip, port=TCP_server_port):
+  def __init__(self, host=TCP_server_ip, port=TCP_server_port, timeout=None):
     """Create a TCP client that can send and receive messages from a persistent connection."""
     self.host = host
     self.port = port
-    self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    self.connection.connect((host, port))
+    # With a timeout, connecting and every send or receive on the connection is bounded by it
+    self.connection = socket.create_connection((host, port), timeout=timeout)
+    self.stream = self.connection.makefile('rb')
+    self.next_id = 0
+
+  def send_requests(self, requests):
+    """
+    Pipeline several requests on the connection and return their responses in the same order.
+    Messages are newline-delimited JSON; each request carries an id that the server echoes back.
+    """
+    responses = []
+    for start in range(0, len(requests), PIPELINE_WINDOW):
+      ids = []
+      payload = []
+      for request in requests[start:start + PIPELINE_WINDOW]:
+        self.next_id += 1
+        ids.append(self.next_id)
+        payload.append(json.dumps(dict(request, id=self.next_id)) + '\n')
+      self.connection.sendall(''.join(payload).encode())
+      received = {}
+      while len(received) < len(ids):
+        line = self.stream.readline()
+        if not line:
+          raise ConnectionError('Connection closed by server')
+        response = json.loads(line)
+        received[response.pop('id', None)] = response
+      responses.extend(received[request_id] for request_id in ids)
+    return responses
 
   def send_request(self, request):
     """Send a JSON request to the server and return the JSON response."""
-    self.connection.sendall(json.dumps(request).encode())
-    return json.loads(self.connection.recv(1024).decode())
+    return self.send_requests([request])[0]
 
   def set_valid(self, value):
     """Send valid MAC address to thr server."""
@@ -47,34 +114,369 @@ class TCPClient:
 
   def close_connection(self):
     """Close the connection to the server."""
+    self.stream.close()
     self.connection.close()
 
-# Initialize TCPClient instances globally
-global_tcp_client = TCPClient()
+class AuthUnavailableError(ConnectionError):
+    """Raised without contacting the authorization server: the circuit breaker is open, a reconnect is backing off, or every connection is busy."""
+
+class AuthClientPool:
+    """
+    Thread-safe pool of up to size connections to the MAC authorization server, so concurrent logins
+    neither interleave on one stream nor queue behind one socket. Connections are made on demand, every
+    call is bounded by timeout, and a connection that fails is closed rather than reused.
+
+    Health: an idle connection the server has closed (readable with nothing pending) is dropped when it
+    is checked out, and one idle for more than health_interval is probed with getHost first.
+    Reconnect: after a failed connect, new connections wait an exponential backoff (backoff doubling up
+    to backoff_max), and calls in that window fail at once.
+    Circuit breaker: after breaker_threshold consecutive failed calls, calls fail at once for
+    breaker_reset seconds; then one trial call is let through, and its success closes the breaker.
+    """
+    def __init__(self, host=TCP_server_ip, port=TCP_server_port, size=web_auth_pool_size, timeout=web_auth_timeout, health_interval=web_auth_health_interval,
+                 backoff=web_auth_backoff, backoff_max=web_auth_backoff_max, breaker_threshold=web_auth_breaker_threshold, breaker_reset=web_auth_breaker_reset):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.idle = []
+        self.created = 0
+        self.connect_delay = 0
+        self.next_connect = 0
+        self.failures = 0
+        self.open_until = 0
+        self.trial = False
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        while True:
+            client = None
+            with self.available:
+                if self.idle:
+                    client, last_used = self.idle.pop()
+                elif self.created < self.size:
+                    if time.time() < self.next_connect:
+                        raise AuthUnavailableError('Reconnecting to the authorization server')
+                    self.created += 1
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise AuthUnavailableError('No authorization server connection available')
+                    self.available.wait(remaining)
+                    continue
+            if client is None:
+                return self.connect()
+            if self.healthy(client, last_used):
+                return client
+            self.discard(client)
+
+    def connect(self):
+        try:
+            client = TCPClient(self.host, self.port, timeout=self.timeout)
+        except OSError:
+            with self.available:
+                self.created -= 1
+                self.connect_delay = min(self.connect_delay * 2 or self.backoff, self.backoff_max)
+                self.next_connect = time.time() + self.connect_delay
+                self.available.notify()
+            raise
+        with self.lock:
+            self.connect_delay = 0
+        return client
+
+    def healthy(self, client, last_used):
+        # Nothing is outstanding on an idle connection, so anything readable means the server closed it
+        if select.select([client.connection], [], [], 0)[0]:
+            return False
+        if time.time() - last_used > self.health_interval:
+            try:
+                client.send_request({'command': 'getHost'})
+            except (OSError, ValueError):
+                return False
+        return True
+
+    def release(self, client):
+        with self.available:
+            self.idle.append((client, time.time()))
+            self.available.notify()
+
+    def discard(self, client):
+        try:
+            client.close_connection()
+        except OSError:
+            pass
+        with self.available:
+            self.created -= 1
+            self.available.notify()
 
-# Close the TCP connection when the program exits
+    def before_call(self):
+        with self.lock:
+            if self.failures >= self.breaker_threshold:
+                if time.time() < self.open_until or self.trial:
+                    raise AuthUnavailableError('Authorization server circuit breaker is open')
+                # Half-open: this call is the trial
+                self.trial = True
+
+    def record(self, success):
+        with self.lock:
+            self.trial = False
+            if success:
+                if self.failures >= self.breaker_threshold:
+                    logging.info("Authorization server is reachable again, closing the circuit breaker")
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= self.breaker_threshold:
+                self.open_until = time.time() + self.breaker_reset
+                if self.failures == self.breaker_threshold:
+                    logging.warning(f"Authorization server failed {self.failures} calls in a row, opening the circuit breaker")
+
+    def send_request(self, request):
+        """Send a JSON request on a pooled connection and return the JSON response."""
+        self.before_call()
+        try:
+            client = self.acquire()
+        except AuthUnavailableError:
+            with self.lock:
+                self.trial = False
+            raise
+        except OSError:
+            self.record(False)
+            raise
+        try:
+            response = client.send_request(request)
+        except (OSError, ValueError):
+            self.discard(client)
+            self.record(False)
+            raise
+        self.release(client)
+        self.record(True)
+        return response
+
+    def set_valid(self, value):
+        """Send valid MAC address to the server."""
+        return self.send_request({'command': 'add', 'value': value})
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for client, _ in idle:
+            client.close_connection()
+
+# Connections are only opened when a login needs one
+auth_clients = AuthClientPool()
+
+# Close the TCP connections when the program exits
 def close_tcp_client():
-    global_tcp_client.close_connection()
+    auth_clients.close()
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands each accepted connection to a fixed pool of worker threads, so a slow request
+    (a login waiting on ARP, say) only holds up its own client. A connection is only accepted once a
+    worker is free; until then new connections wait in the listen backlog. While every worker is busy,
+    handlers close kept-alive connections after their response instead of waiting on them.
+    """
+    def __init__(self, server_address, handler_class, workers=web_workers):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers)
+        self.busy = 0
+        self.busy_lock = threading.Lock()
+
+    def saturated(self):
+        return self.busy >= self.workers
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        with self.busy_lock:
+            self.busy += 1
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.busy_lock:
+                self.busy -= 1
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+class StaticAssets:
+    """
+    The web/ tree held in memory. Each file is read once and stored with its header block already
+    encoded, plus gzip and (if the brotli module is installed) brotli bodies when they are smaller, so
+    serving it is a dict lookup and one write. ETag and Last-Modified let browsers revalidate with a
+    304; each content-coding has its own strong ETag (the identity one with a -gzip or -br suffix), as
+    the bodies differ. With reload set, the tree is re-read whenever a file changes; lookups always see either the old
+    table or the new one, never a mix.
+    """
+    def __init__(self, root=WEB_ROOT, reload=web_static_reload == 'True', reload_interval=web_static_reload_interval):
+        self.root = root
+        self.reload_interval = reload_interval
+        self.assets, self.mtimes = self.load()
+        if reload:
+            threading.Thread(target=self.reload_forever, daemon=True).start()
+
+    def scan(self):
+        """Return {url path: (file path, mtime)} for every file under root."""
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                file_path = os.path.join(directory, name)
+                url_path = '/' + os.path.relpath(file_path, self.root).replace(os.sep, '/')
+                files[url_path] = (file_path, os.stat(file_path).st_mtime)
+        return files
+
+    def load(self):
+        files = self.scan()
+        assets = {}
+        for url_path, (file_path, mtime) in files.items():
+            with open(file_path, 'rb') as file:
+                body = file.read()
+            mimetype = MIME_TYPES.get(os.path.splitext(url_path)[1], 'text/plain')
+            digest = hashlib.sha1(body).hexdigest()[:16]
+            last_modified = formatdate(mtime, usegmt=True)
+            encoded = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+            if brotli is not None:
+                encoded['br'] = brotli.compress(body)
+            variants = {}
+            for encoding, content in encoded.items():
+                if encoding != 'identity' and len(content) >= len(body):
+                    continue
+                etag = f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+                coding = '' if encoding == 'identity' else f'Content-Encoding: {encoding}\r\n'
+                headers = f'Content-type: {mimetype}\r\nETag: {etag}\r\nLast-Modified: {last_modified}\r\nCache-Control: no-cache\r\nVary: Accept-Encoding\r\n{coding}Content-Length: {len(content)}\r\n\r\n'
+                not_modified = f'ETag: {etag}\r\nLast-Modified: {last_modified}\r\nCache-Control: no-cache\r\nVary: Accept-Encoding\r\n\r\n'
+                variants[encoding] = (headers.encode(), content, etag, not_modified.encode())
+            assets[url_path] = (variants, int(mtime))
+        return assets, {url_path: mtime for url_path, (_, mtime) in files.items()}
+
+    def reload_forever(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                if {url_path: mtime for url_path, (_, mtime) in self.scan().items()} != self.mtimes:
+                    self.assets, self.mtimes = self.load()
+                    logging.info(f"Reloaded {len(self.assets)} static file(s) from {self.root}")
+            except OSError as e:
+                logging.warning(f"Could not reload static files: {e}")
+
+    def get(self, path):
+        return self.assets.get(path)
+
+static_assets = StaticAssets()
+
+@functools.lru_cache(maxsize=16)
+def redirect_template(redirect_domain):
+    """The bytes of a 302 to redirect_domain up to its Location's original_host value, for the redirect fast path."""
+    return f'HTTP/1.1 302 Found\r\nContent-Length: 0\r\nCache-Control: no-store\r\nLocation: {protocol}://{redirect_domain}/?original_host='.encode()
+
+http_date_cache = (0, b'')
+
+def http_date():
+    """The current time as an HTTP Date header value plus the blank line ending the headers, formatted once a second."""
+    global http_date_cache
+    now = int(time.time())
+    if http_date_cache[0] != now:
+        http_date_cache = (now, formatdate(now, usegmt=True).encode() + b'\r\n\r\n')
+    return http_date_cache[1]
+
+def accepted_encodings(header):
+    """Return the content codings an Accept-Encoding header allows (ignoring those given q=0)."""
+    encodings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(coding.strip().lower())
+    return encodings
+
+def arp_probe(ip):
+    """ Use an ARP request to obtain the MAC address of a specified IP """
+    # Constructing an Ethernet broadcast frame and ARP request
+    arp_request = ARP(pdst=ip)
+    broadcast = Ether(dst="ff:ff:ff:ff:ff:ff")
+    arp_request_broadcast = broadcast/arp_request
+
+    # Send a request and get a response
+    answered, _ = srp(arp_request_broadcast, timeout=2, verbose=False)
+
+    # Extract MAC address from response
+    return answered[0][1].hwsrc if answered else None
+
+# A client that can reach the portal is almost always in the kernel's neighbor table already
+mac_resolver = MACResolver(arp_probe if srp is not None else None, ttl=arp_probe_cache_ttl, neighbors=NeighborCache(ttl=neighbor_cache_ttl))
 
 class RedirectHandler(SimpleHTTPRequestHandler):
-    def get_mac(self, ip):
-        """ Use an ARP request to obtain the MAC address of a specified IP """
-        # Constructing an Ethernet broadcast frame and ARP request
-        arp_request = ARP(pdst=ip)
-        broadcast = Ether(dst="ff:ff:ff:ff:ff:ff")
-        arp_request_broadcast = broadcast/arp_request
+    # HTTP/1.1 keeps connections open between requests, so every response carries a Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Drop connections that stall mid-request instead of letting them hold a worker
+    timeout = web_request_timeout
+
+    def handle(self):
+        """Serve requests until the client closes; an idle kept-alive connection is dropped after web_keepalive_timeout."""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self):
+        """Wait up to web_keepalive_timeout for the next request to start; the request itself then gets the full timeout."""
+        self.connection.settimeout(web_keepalive_timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def server_saturated(self):
+        # A plain HTTPServer has a single thread, and this connection is holding it
+        saturated = getattr(self.server, 'saturated', None)
+        return saturated() if saturated is not None else True
 
-        # Send a request and get a response
-        answered, _ = srp(arp_request_broadcast, timeout=2, verbose=False)
+    def connection_header(self):
+        """'Connection: close' if every worker is busy, so this one goes to a waiting client after the response; else nothing."""
+        if not self.close_connection and self.server_saturated():
+            self.close_connection = True
+            return b'Connection: close\r\n'
+        return b''
 
-        # Extract MAC address from response
-        return answered[0][1].hwsrc if answered else "Unknown"
+    def end_headers(self):
+        if not self.close_connection and self.server_saturated():
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        # The access log line goes through the log queue instead of a synchronous write to stderr
+        request_log.info("%s - " + format, self.address_string(), *args)
+
+    def get_mac(self, ip):
+        """ Obtain the MAC address of a specified IP (None if it cannot be found), sending an ARP request only if it is not already known """
+        return mac_resolver.resolve(ip)
     
     def redirect_handler(self, redirect_domain, host):
-        logging.info(f"Redirecting to {redirect_domain} from host {host}")
-        self.send_response(302)
-        self.send_header('Location', f'{protocol}://{redirect_domain}/?original_host={host}')
-        self.end_headers()
+        """
+        Fast path for the bulk of the traffic: one log record and one write of a preformatted response,
+        instead of send_response()/send_header()/end_headers() and the access log.
+        """
+        request_log.info("Redirecting to %s from host %s", redirect_domain, host)
+        head = redirect_template(redirect_domain)
+        self.wfile.write(head + host.encode('latin-1', 'replace') + b'\r\n' + self.connection_header() + b'Date: ' + http_date())
     
     def request_handler(self):
         path = self.path.split('?', 1)[0]
@@ -84,28 +486,46 @@ class RedirectHandler(SimpleHTTPRequestHandler):
         elif '.' not in path:
             path += '.html'
 
-        if path.endswith(".html"):
-            mimetype = 'text/html'
-        elif path.endswith(".css"):
-            mimetype = 'text/css'
-        elif path.endswith(".js"):
-            mimetype = 'application/javascript'
+        asset = static_assets.get(path)
+        if asset is None:
+            self.send_error(404, 'File Not Found: %s' % path)
+            return
+        variants, mtime = asset
+        encodings = accepted_encodings(self.headers.get('Accept-Encoding', ''))
+        for encoding in ('br', 'gzip'):
+            if encoding in encodings and encoding in variants:
+                break
         else:
-            mimetype = 'text/plain'
+            encoding = 'identity'
+        headers, body, etag, not_modified = variants[encoding]
+        # Revalidate against the ETag of the encoding this client would get
+        if self.not_modified(etag, mtime):
+            self.log_request(304)
+            self.wfile.write(self.status_line(304, 'Not Modified') + not_modified)
+            return
+        self.log_request(200)
+        self.wfile.write(self.status_line(200, 'OK') + headers + body)
 
+    def not_modified(self, etag, mtime):
+        """Whether the client's cached copy is current: If-None-Match decides if present, else If-Modified-Since."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.replace('W/', '').split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
         try:
-            with open(f'../web/{path[1:]}', 'rb') as file: 
-                self.send_response(200)
-                self.send_header('Content-type', mimetype)
-                self.end_headers()
-                self.wfile.write(file.read())
-        except FileNotFoundError:
-            self.send_error(404, 'File Not Found: %s' % path)
+            return parsedate_to_datetime(if_modified_since).timestamp() >= mtime
+        except (TypeError, ValueError):
+            return False
+
+    def status_line(self, code, message):
+        """Status line plus the Server and Date headers send_response() would add, and Connection: close if the pool is full."""
+        return f'{self.protocol_version} {code} {message}\r\nServer: {self.version_string()}\r\nDate: {self.date_time_string()}\r\n'.encode() + self.connection_header()
 
     def do_GET(self):
         # Check the host header to determine the domain of the request
         host = self.headers.get('Host')
-        logging.info(f"Received GET request for {self.path} from {host}")
 
         # Define the target domain for the redirect
         # redirect_domain = 'captive-portal.com'
@@ -115,13 +535,14 @@ class RedirectHandler(SimpleHTTPRequestHandler):
         if host and host != redirect_domain:
             self.redirect_handler(redirect_domain, f'https://{host}{self.path}')
         else:
+            request_log.info("Received GET request for %s from %s", self.path, host)
             # Otherwise, serve the normal content
             self.request_handler()
     
     def do_POST(self):
         # Get the requested IP and MAC address
         request_ip = self.client_address[0]
-        logging.info(f"Received POST request for {self.path} from IP {request_ip}")
+        request_log.info("Received POST request for %s from IP %s", self.path, request_ip)
         mac_address = self.get_mac(request_ip)
 
         content_length = int(self.headers['Content-Length'])
@@ -139,31 +560,40 @@ class RedirectHandler(SimpleHTTPRequestHandler):
             # Check credentials
             response = {'success': False}
             if data.get('username') == 'test' and data.get('password') == 'pass':
-                try:
-                    data = global_tcp_client.set_valid(mac_address)
-                    if data['result']:
-                        response = {'success': True}
-                    else:
-                        response = {'success': False, 'error': 'MAC address not added correctly'}
-                except Exception as e:
-                    response = {'success': False, 'error': str(e)}
+                if mac_address is None:
+                    # There is nothing to authorize without the device's MAC
+                    logging.warning(f"Could not determine the MAC address of {request_ip} for login")
+                    response = {'success': False, 'error': 'Could not determine your device address'}
+                else:
+                    try:
+                        data = auth_clients.set_valid(mac_address)
+                        if data.get('result'):
+                            response = {'success': True}
+                        else:
+                            # The server answers a bad request with an error and no result
+                            response = {'success': False, 'error': data.get('error', 'MAC address not added correctly')}
+                    except Exception as e:
+                        response = {'success': False, 'error': str(e)}
 
             # Send JSON response
+            body = json.dumps(response).encode('utf-8')
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            self.wfile.write(body)
         else:
+            body = f'404 Not Found: {path}'.encode('utf-8')
             self.send_response(404)
             self.send_header('Content-type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            response = f'404 Not Found: {path}'
-            self.wfile.write(response.encode('utf-8'))
+            self.wfile.write(body)
 
 def run(port):
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, RedirectHandler)
-    logging.info(f'Starting server on port {port}')
+    httpd = PooledHTTPServer(server_address, RedirectHandler)
+    logging.info(f'Starting server on port {port} with {web_workers} workers')
     return httpd
 
 # Starting the HTTP server
@@ -176,10 +606,12 @@ def start_http_server():
 def start_https_server():
     global httpsd
     httpsd = run(port=443)
+    # The TLS handshake is left to the worker's first read, so a slow client does not stall accept()
     httpsd.socket = ssl.wrap_socket(httpsd.socket, 
                                     keyfile=keyfile, 
                                     certfile=certfile, 
-                                    server_side=True)
+                                    server_side=True,
+                                    do_handshake_on_connect=False)
     httpsd.serve_forever()
 
 # Close the HTTP and HTTPS servers
@@ -192,10 +624,11 @@ def close_servers():
         httpsd.shutdown()
         httpsd.server_close()
 
-# Register the close_servers function to be called when the program exits
-atexit.register(close_servers)
-atexit.register(close_tcp_client)
+if __name__ == '__main__':
+    # Register the close_servers function to be called when the program exits
+    atexit.register(close_servers)
+    atexit.register(close_tcp_client)
 
-threading.Thread(target=start_http_server).start()
-if (ssl_enable == 'True'):
-    threading.Thread(target=start_https_server).start()
+    threading.Thread(target=start_http_server).start()
+    if (ssl_enable == 'True'):
+        threading.Thread(target=start_https_server).start()
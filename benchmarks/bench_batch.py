@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+from tcp_server import Server
+from client import TCPClient
+
+PORT = 65480
+COUNT = 5000
+
+def per_mac_us(start, count):
+    return (time.perf_counter() - start) / count * 1e6
+
+def main():
+    """Compare the per-MAC cost of add/check against addMany/checkMany on a local server."""
+    server = Server(host='127.0.0.1', port=PORT, journal_file='')
+    threading.Thread(target=server.run_tcp_server, daemon=True).start()
+    time.sleep(0.2)
+    client = TCPClient(host='127.0.0.1', port=PORT)
+    macs = ['02:00:00:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xff, i & 0xff) for i in range(COUNT)]
+
+    start = time.perf_counter()
+    for mac in macs:
+        client.send_request({'command': 'add', 'value': mac})
+    print(f"add        {per_mac_us(start, COUNT):8.2f} us/MAC")
+
+    start = time.perf_counter()
+    client.send_request({'command': 'addMany', 'value': macs})
+    print(f"addMany    {per_mac_us(start, COUNT):8.2f} us/MAC")
+
+    start = time.perf_counter()
+    for mac in macs:
+        client.send_request({'command': 'check', 'value': mac})
+    print(f"check      {per_mac_us(start, COUNT):8.2f} us/MAC")
+
+    start = time.perf_counter()
+    client.send_request({'command': 'checkMany', 'value': macs})
+    print(f"checkMany  {per_mac_us(start, COUNT):8.2f} us/MAC")
+
+    client.close_connection()
+    server.stop_server()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+from tcp_server import Server
+
+ENTRIES = 100000
+DURATION = 1.0
+
+def measure(server, threads, locked):
+    """Count checks/s across threads while a writer keeps adding MACs."""
+    macs = ['02:00:00:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xff, i & 0xff) for i in range(0, ENTRIES, 97)]
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def reader(index):
+        count = 0
+        while not stop.is_set():
+            for mac in macs:
+                if locked:
+                    with server.lock:
+                        server.check_mac(mac)
+                else:
+                    server.check_mac(mac)
+            count += len(macs)
+        counts[index] = count
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            server.add_mac('04:00:00:%02x:%02x:%02x' % ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff))
+            i += 1
+
+    workers = [threading.Thread(target=reader, args=(index,)) for index in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(DURATION)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+def main():
+    """Compare lock-free checks against checks that take Server.lock, with 1 to 8 reader threads."""
+    server = Server(journal_file='')
+    server.add_macs(['02:00:00:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xff, i & 0xff) for i in range(ENTRIES)])
+    for threads in (1, 2, 4, 8):
+        locked = measure(server, threads, True)
+        free = measure(server, threads, False)
+        print(f"{threads} threads   locked {locked:12.0f} checks/s   lock-free {free:12.0f} checks/s")
+
+if __name__ == '__main__':
+    main()
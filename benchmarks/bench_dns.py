@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import dns_server
+
+UPSTREAM_PORT = 65490
+FORWARDER_PORT = 65491
+UPSTREAM_DELAY = 0.02
+CLIENTS = 32
+QUERIES_PER_CLIENT = 100
+
+def build_query(name, query_id=0x1234, qtype=1):
+    """Encode a recursive query for name."""
+    question = b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\x00'
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack('!HH', qtype, 1)
+
+def build_answer(query, address='93.184.216.34', ttl=300):
+    """Answer query with a single A record pointing back at its question name."""
+    query_id = struct.unpack_from('!H', query)[0]
+    end = query.index(b'\x00', 12) + 5
+    header = struct.pack('!HHHHHH', query_id, 0x8180, 1, 1, 0, 0)
+    record = struct.pack('!HHHIH', 0xc00c, 1, 1, ttl, 4) + socket.inet_aton(address)
+    return header + query[12:end] + record
+
+class StubUpstream:
+    """A local stand-in for the upstream resolver that answers every query after delay seconds."""
+    def __init__(self, port=UPSTREAM_PORT, delay=UPSTREAM_DELAY):
+        self.delay = delay
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.executor = ThreadPoolExecutor(max_workers=256)
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            data, addr = self.sock.recvfrom(dns_server.DNS_BUFFER_SIZE)
+            self.queries += 1
+            self.executor.submit(self.answer, data, addr)
+
+    def answer(self, data, addr):
+        time.sleep(self.delay)
+        self.sock.sendto(build_answer(data), addr)
+
+def run_load(port, names, clients=CLIENTS, queries=QUERIES_PER_CLIENT):
+    """Send queries from concurrent clients, each waiting for its answer, and return (qps, p50, p99, lost)."""
+    latencies = []
+    lost = [0]
+    lock = threading.Lock()
+
+    def client(index):
+        samples = []
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(2)
+            for i in range(queries):
+                query = build_query(names[(index * queries + i) % len(names)], query_id=i)
+                start = time.perf_counter()
+                sock.sendto(query, ('127.0.0.1', port))
+                try:
+                    sock.recvfrom(dns_server.DNS_BUFFER_SIZE)
+                    samples.append(time.perf_counter() - start)
+                except socket.timeout:
+                    with lock:
+                        lost[0] += 1
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    if not latencies:
+        return 0, 0, 0, lost[0]
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], lost[0]
+
+def report(name, result):
+    qps, p50, p99, lost = result
+    print(f"{name:24} {qps:8.0f} qps   p50 {p50 * 1e3:7.2f} ms   p99 {p99 * 1e3:7.2f} ms   lost {lost}")
+
+def main():
+    """Compare one-at-a-time forwarding with the pooled socket forwarder against a stub upstream."""
+    StubUpstream()
+    # Every query is for a distinct name, so the answer cache never helps here
+    names = [f"host{i}.example.com" for i in range(CLIENTS * QUERIES_PER_CLIENT)]
+    for name, workers, port in (('sequential (1 worker)', 1, FORWARDER_PORT), (f'pooled ({dns_server.dns_workers} workers)', dns_server.dns_workers, FORWARDER_PORT + 1)):
+        resolver = dns_server.DNSResolver(upstreams=[('127.0.0.1', UPSTREAM_PORT)])
+        forwarder = dns_server.DNSForwarder('127.0.0.1', port, resolver=resolver, workers=workers)
+        threading.Thread(target=forwarder.serve_forever, daemon=True).start()
+        report(name, run_load(port, names))
+
+if __name__ == '__main__':
+    main()
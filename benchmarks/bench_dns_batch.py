@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import batch_io
+import dns_server
+from bench_dns import StubUpstream, build_query
+
+UPSTREAM_PORT = 65492
+FORWARDER_PORT = 65493
+CLIENTS = 8
+WINDOW = 32
+DURATION = 3
+NAMES = 100
+
+def flood(port, names, clients=CLIENTS, window=WINDOW, duration=DURATION):
+    """Each client keeps window queries outstanding for duration seconds; return answered datagrams/sec."""
+    answered = [0] * clients
+
+    def client(index):
+        queries = [build_query(names[i % len(names)], query_id=i) for i in range(window)]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.5)
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                for query in queries:
+                    sock.sendto(query, ('127.0.0.1', port))
+                try:
+                    for _ in queries:
+                        sock.recvfrom(dns_server.DNS_BUFFER_SIZE)
+                        answered[index] += 1
+                except socket.timeout:
+                    pass
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(answered) / (time.perf_counter() - start)
+
+def main():
+    """Compare datagrams/sec of the one-at-a-time receive loop with recvmmsg/sendmmsg batches, on cached answers."""
+    StubUpstream(port=UPSTREAM_PORT, delay=0)
+    names = [f"host{i}.example.com" for i in range(NAMES)]
+    print(f"recvmmsg/sendmmsg available: {batch_io.MMSG_AVAILABLE}")
+    for name, batch_size, port in (('one at a time', 1, FORWARDER_PORT), (f'batches of {dns_server.dns_batch_size}', dns_server.dns_batch_size, FORWARDER_PORT + 1)):
+        resolver = dns_server.DNSResolver(upstreams=[('127.0.0.1', UPSTREAM_PORT)])
+        for query_name in names:
+            resolver.resolve(build_query(query_name))
+        forwarder = dns_server.DNSForwarder('127.0.0.1', port, resolver=resolver, batch_size=batch_size)
+        threading.Thread(target=forwarder.serve_forever, daemon=True).start()
+        print(f"{name:20} {flood(port, names):9.0f} datagrams/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import socket
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import dns_server
+from bench_dns import StubUpstream, build_query
+
+try:
+    from scapy.all import DNS, Ether, IP, UDP, conf
+except ImportError:
+    DNS = None
+
+UPSTREAM_PORT = 65494
+ITERATIONS = 100000
+CAPTURE_ITERATIONS = 20000
+
+def build_frame(query, client_ip='10.0.0.100', server_ip='8.8.8.8'):
+    """Wrap query in the Ethernet/IPv4/UDP frame the sniffer would capture."""
+    ether = bytes.fromhex('000000000001') + bytes.fromhex('02000000aa01') + b'\x08\x00'
+    packet = dns_server.build_udp_packet(socket.inet_aton(client_ip), socket.inet_aton(server_ip), 40000, 53, query)
+    return ether + packet
+
+def fast_path(resolver, frame):
+    """What handle_frame does for a cache hit, minus the sendto()."""
+    src_mac, src, dst, sport, dport, data = dns_server.parse_frame(frame)
+    response = resolver.resolve(data)
+    return dns_server.build_udp_packet(dst, src, dport, sport, response)
+
+def scapy_path(resolver, packet):
+    """The previous interceptor, given the packet sniff() had already dissected: rebuild the reply from a parsed copy of the response."""
+    response_packet = DNS(resolver.resolve(bytes(packet[UDP].payload)))
+    reply = IP(dst=packet[IP].src, src=packet[IP].dst) /\
+            UDP(dport=packet[UDP].sport, sport=packet[UDP].dport) /\
+            DNS(id=packet[DNS].id, qr=1, aa=packet[DNS].aa, qd=packet[DNS].qd, an=response_packet.an, ns=response_packet.ns, ar=response_packet.ar)
+    return bytes(reply)
+
+def measure(name, function, iterations=ITERATIONS):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    per_query = (time.perf_counter() - start) / iterations
+    print(f"{name:28} {per_query * 1e6:8.2f} us/query")
+
+def capture_path(resolver, sender, query, recv, answer):
+    """The whole sniff-mode receive path for one query: send it over loopback, capture it with recv() and answer it."""
+    sender.sendto(query, ('127.0.0.1', 53))
+    return answer(resolver, recv())
+
+def main():
+    """
+    Time answering a cached query: first from a frame already in memory, raw wire bytes versus scapy's
+    dissection (which sniff() did to every frame), then end to end through each capture socket on loopback.
+    """
+    StubUpstream(port=UPSTREAM_PORT, delay=0)
+    resolver = dns_server.DNSResolver(upstreams=[('127.0.0.1', UPSTREAM_PORT)])
+    frame = build_frame(build_query('www.example.com', query_id=0x4242))
+    resolver.resolve(build_query('www.example.com'))
+    measure('wire bytes (fresh entry)', lambda: fast_path(resolver, frame))
+    # Age the entry so every hit also lowers the record TTLs
+    key = dns_server.question_key(build_query('www.example.com'))
+    response, expires_at, stored_at, ttls = resolver.cache.entries[key]
+    resolver.cache.entries[key] = (response, expires_at, stored_at - 30, ttls)
+    reply = fast_path(resolver, frame)
+    print(f"TTL after 30s in the cache: {struct.unpack_from('!I', reply, len(reply) - 10)[0]}")
+    measure('wire bytes (TTL patched)', lambda: fast_path(resolver, frame))
+    if DNS is not None:
+        measure('scapy objects', lambda: scapy_path(resolver, Ether(frame)), ITERATIONS // 100)
+    query = build_query('www.example.com', query_id=0x4242)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sniffer = dns_server.FrameSniffer(interface='lo', promiscuous=False)
+    except PermissionError:
+        print('capturing needs root (CAP_NET_RAW); skipping the capture paths')
+        return
+    measure('capture, AF_PACKET + BPF', lambda: capture_path(resolver, sender, query, sniffer.recv, fast_path), CAPTURE_ITERATIONS)
+    sniffer.sock.close()
+    if DNS is None:
+        print('scapy is not installed; skipping the scapy paths')
+        return
+    # What sniff() reads from: every frame comes back dissected into Ether/IP/UDP/DNS objects
+    listener = conf.L2listen(iface='lo', filter='udp dst port 53')
+    measure('capture, scapy sniff', lambda: capture_path(resolver, sender, query, listener.recv, scapy_path), CAPTURE_ITERATIONS // 100)
+    listener.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import heapq
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+from tcp_server import MACSet, int_to_mac
+
+ENTRIES = 200000
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / ENTRIES, result
+
+def string_dict():
+    """The original representation: canonical strings mapped to datetime, plus a tuple heap for expiry."""
+    approved = {}
+    heap = []
+    for i in range(ENTRIES):
+        mac = int_to_mac(0x020000000000 + i)
+        approved[mac] = datetime.now()
+        heap.append((approved[mac].timestamp(), mac))
+    heapq.heapify(heap)
+    return approved, heap
+
+def mac_table():
+    mac_set = MACSet()
+    mac_set.add_macs([0x020000000000 + i for i in range(ENTRIES)])
+    return mac_set
+
+def main():
+    """Report memory per approved MAC for the str/datetime dict and for MACSet's integer table."""
+    for name, build in (('str/datetime dict', string_dict), ('MACTable', mac_table)):
+        per_entry, _ = measure(build)
+        print(f"{name:18} {per_entry:7.1f} bytes/MAC")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import logging
+import threading
+import http.client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import web_server
+
+WEB_PORT = 65484
+CLIENTS = 8
+DURATION = 3
+
+class LegacyRedirectHandler(web_server.RedirectHandler):
+    """The redirect path as it was: HTTP/1.0, send_response()/send_header()/end_headers() and two log records."""
+    protocol_version = 'HTTP/1.0'
+
+    def handle(self):
+        web_server.SimpleHTTPRequestHandler.handle(self)
+
+    def log_message(self, format, *args):
+        logging.info("%s - " + format, self.address_string(), *args)
+
+    def redirect_handler(self, redirect_domain, host):
+        logging.info(f"Redirecting to {redirect_domain} from host {host}")
+        self.send_response(302)
+        self.send_header('Location', f'{web_server.protocol}://{redirect_domain}/?original_host={host}')
+        self.end_headers()
+
+    def do_GET(self):
+        host = self.headers.get('Host')
+        logging.info(f"Received GET request for {self.path} from {host}")
+        self.redirect_handler(web_server.captive_portal_host, f'https://{host}{self.path}')
+
+def load(port, keep_alive, clients=CLIENTS, duration=DURATION):
+    """Fetch captive-portal probe URLs from concurrent clients for duration seconds; return (redirects/s, p99)."""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        samples = []
+        connection = None
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            if connection is None:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.request('GET', '/generate_204', headers={'Host': 'connectivitycheck.example.com'})
+            response = connection.getresponse()
+            response.read()
+            if not keep_alive or response.will_close:
+                connection.close()
+                connection = None
+            samples.append(time.perf_counter() - start)
+        if connection is not None:
+            connection.close()
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[int(len(latencies) * 0.99)]
+
+def main():
+    """Redirects/sec of the old send_response() path against the preformatted fast path, with and without keep-alive."""
+    cases = (('before (HTTP/1.0)', LegacyRedirectHandler, False), ('fast path, new connections', web_server.RedirectHandler, False), ('fast path, keep-alive', web_server.RedirectHandler, True))
+    for index, (name, handler, keep_alive) in enumerate(cases):
+        httpd = web_server.PooledHTTPServer(('127.0.0.1', WEB_PORT + index), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        rate, p99 = load(WEB_PORT + index, keep_alive)
+        print(f"{name:28} {rate:8.0f} redirects/s   p99 {p99 * 1e3:7.2f} ms")
+        httpd.shutdown()
+        httpd.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+from tcp_server import MACJournal, MACSet
+
+ENTRIES = 1000000
+BATCH = 10000
+
+def main():
+    """Journal ENTRIES approvals, then time how long a restart takes to restore them."""
+    with tempfile.TemporaryDirectory() as directory:
+        journal_file = os.path.join(directory, 'approved_macs.journal')
+        snapshot_file = os.path.join(directory, 'approved_macs.snapshot')
+        macs = [0x020000000000 + i for i in range(ENTRIES)]
+
+        journal = MACJournal(journal_file, snapshot_file, fsync='never')
+        mac_set = MACSet(journal=journal)
+        mac_set.restore(journal.open())
+        start = time.perf_counter()
+        for i in range(0, ENTRIES, BATCH):
+            mac_set.add_macs(macs[i:i + BATCH])
+        print(f"journaled {ENTRIES} adds in {time.perf_counter() - start:.3f}s")
+        journal.close()
+
+        for source in ('journal', 'snapshot'):
+            journal = MACJournal(journal_file, snapshot_file, fsync='never')
+            start = time.perf_counter()
+            mac_set = MACSet(journal=journal)
+            mac_set.restore(journal.open())
+            print(f"restored {len(mac_set.table)} MACs from {source} in {time.perf_counter() - start:.3f}s")
+            # Compact so the next pass restores from the snapshot alone
+            journal.rotate()
+            journal.write_snapshot(mac_set.table.copy())
+            journal.close()
+
+if __name__ == '__main__':
+    main()
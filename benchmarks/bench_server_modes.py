@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import socket
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+from tcp_server import Server
+from client import TCPClient
+
+PORT = 65481
+CONNECTIONS = 2000
+CONNECT_THREADS = 8
+CLIENTS = 200
+REQUESTS_PER_CLIENT = 200
+
+def serve(mode):
+    Server(host='127.0.0.1', port=PORT, journal_file='').run(mode)
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', PORT)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('Server did not start')
+
+def connections_per_second():
+    """Open a connection, send one check and close it, from several threads at once."""
+    def worker(count):
+        for _ in range(count):
+            client = TCPClient(host='127.0.0.1', port=PORT)
+            client.send_request({'command': 'check', 'value': '02:00:00:00:00:01'})
+            client.close_connection()
+
+    threads = [threading.Thread(target=worker, args=(CONNECTIONS // CONNECT_THREADS,)) for _ in range(CONNECT_THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return CONNECTIONS / (time.perf_counter() - start)
+
+def request_latencies():
+    """Keep CLIENTS connections open and record the latency of every check they send."""
+    clients = [TCPClient(host='127.0.0.1', port=PORT) for _ in range(CLIENTS)]
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(client):
+        samples = []
+        for _ in range(REQUESTS_PER_CLIENT):
+            start = time.perf_counter()
+            client.send_request({'command': 'check', 'value': '02:00:00:00:00:01'})
+            samples.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        client.close_connection()
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+def main():
+    """Load test the threaded and asyncio server modes, each in its own process."""
+    for mode in ('threaded', 'asyncio'):
+        process = multiprocessing.Process(target=serve, args=(mode,), daemon=True)
+        process.start()
+        wait_for_server()
+        rate = connections_per_second()
+        p50, p99 = request_latencies()
+        print(f"{mode:9} {rate:8.0f} connections/s   p50 {p50 * 1e3:6.2f} ms   p99 {p99 * 1e3:6.2f} ms")
+        process.terminate()
+        process.join()
+
+if __name__ == '__main__':
+    main()
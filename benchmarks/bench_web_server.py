@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import time
+import threading
+import http.client
+from http.server import HTTPServer
+
+ANSWER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer')
+sys.path.insert(0, ANSWER_DIR)
+import web_server
+from tcp_server import Server
+
+AUTH_PORT = 65482
+WEB_PORT = 65483
+LOGIN_DELAY = 2
+LOGIN_CLIENTS = 4
+REDIRECT_CLIENTS = 16
+DURATION = 5
+
+class SlowARPHandler(web_server.RedirectHandler):
+    """RedirectHandler whose ARP lookup takes as long as an unanswered srp() does."""
+    def get_mac(self, ip):
+        time.sleep(LOGIN_DELAY)
+        return '02:00:00:00:00:01'
+
+def load(port, duration=DURATION):
+    """Log in continuously from LOGIN_CLIENTS while REDIRECT_CLIENTS fetch redirects; return (redirects/s, p50, p99)."""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def login():
+        body = json.dumps({'username': 'test', 'password': 'pass'})
+        while time.perf_counter() < deadline:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('POST', '/login', body, {'Content-Type': 'application/json'})
+            connection.getresponse().read()
+            connection.close()
+
+    def redirect():
+        samples = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('GET', '/generate_204', headers={'Host': 'connectivitycheck.example.com'})
+            connection.getresponse().read()
+            connection.close()
+            samples.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=login) for _ in range(LOGIN_CLIENTS)] + [threading.Thread(target=redirect) for _ in range(REDIRECT_CLIENTS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+def main():
+    """Compare redirect throughput and latency of the single-threaded HTTPServer and the worker pool during slow logins."""
+    os.chdir(ANSWER_DIR)
+    auth_server = Server(host='127.0.0.1', port=AUTH_PORT, journal_file='')
+    threading.Thread(target=auth_server.run_tcp_server, daemon=True).start()
+    time.sleep(0.2)
+    web_server.auth_clients = web_server.AuthClientPool(host='127.0.0.1', port=AUTH_PORT)
+    for name, server_class, port in (('HTTPServer', HTTPServer, WEB_PORT), (f'pooled ({web_server.web_workers} workers)', web_server.PooledHTTPServer, WEB_PORT + 1)):
+        httpd = server_class(('127.0.0.1', port), SlowARPHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        rate, p50, p99 = load(port)
+        print(f"{name:22} {rate:8.0f} redirects/s   p50 {p50 * 1e3:8.2f} ms   p99 {p99 * 1e3:8.2f} ms")
+        httpd.shutdown()
+        httpd.server_close()
+
+if __name__ == '__main__':
+    main()
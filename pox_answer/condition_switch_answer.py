@@ -1,12 +1,57 @@
+import time
 import configparser
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.lib.util import str_to_bool
 from pox.lib.addresses import EthAddr
-from tcp_client import tcp_client
+from tcp_client import TCPClient
+
+config = configparser.ConfigParser()
+config.read('/home/mininet/Captive-Portal/config.ini')
+approval_cache_ttl = float(config['DEFAULT']['approval_cache_ttl'])
+approval_cache_negative_ttl = float(config['DEFAULT']['approval_cache_negative_ttl'])
+approval_cache_subscribed_ttl = float(config['DEFAULT']['approval_cache_subscribed_ttl'])
+host_refresh_interval = float(config['DEFAULT']['host_refresh_interval'])
+approved_flow_idle_timeout = int(config['DEFAULT']['approved_flow_idle_timeout'])
 
 log = core.getLogger()
 
+class ApprovalCache(object):
+    """
+    Controller-side view of the MAC authorization server. Maps a MAC address to whether it is approved and when
+    that answer stops being trusted, so the PacketIn hot path only goes to the server on a miss.
+    """
+    def __init__(self, ttl=approval_cache_ttl, negative_ttl=approval_cache_negative_ttl):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mac):
+        """Return the cached approval for mac, or None if it is unknown or expired."""
+        entry = self.entries.get(mac)
+        if entry is not None:
+            approved, expires_at = entry
+            if expires_at > time.time():
+                self.hits += 1
+                return approved
+            del self.entries[mac]
+        self.misses += 1
+        return None
+
+    def set(self, mac, approved):
+        """Remember the server's answer for mac. Denials are kept shorter so a fresh login is noticed quickly."""
+        ttl = self.ttl if approved else self.negative_ttl
+        self.entries[mac] = (approved, time.time() + ttl)
+
+    def invalidate(self, mac=None):
+        """Forget mac, or every entry when mac is None."""
+        if mac is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(mac, None)
+
 class LearningSwitch(object):
     def __init__(self, connection, transparent):
         # Switch connection
@@ -19,24 +64,117 @@ class LearningSwitch(object):
         # Listen to the connection
         connection.addListeners(self)
 
-        self.tcp_client = tcp_client()
+        self.tcp_client = TCPClient()
+        self.approval_cache = ApprovalCache()
         self.captive_portal_mac = EthAddr(self.tcp_client.get_host()['result'])
         self.internet_mac = EthAddr(self.tcp_client.get_internet()['result'])
+        self.host_checked_at = time.time()
+        self.subscribed = False
+        self.tcp_client.subscribe(self.on_server_event)
 
     def check_valid(self, source_mac):
-        return self.tcp_client.check_valid(str(source_mac))['result']
+        """Return whether source_mac is approved, asking the server only when the cache has no answer."""
+        approved = self.approval_cache.get(source_mac)
+        if approved is None:
+            approved = self.tcp_client.check_valid(str(source_mac))['result']
+            self.approval_cache.set(source_mac, approved)
+        return approved
 
-    def _handle_PacketIn(self, event):
+    def invalidate(self, mac=None):
+        """Drop cached approvals so the next packet from mac is checked against the server again."""
+        self.approval_cache.invalidate(mac)
+
+    def on_server_event(self, event, value):
+        """Called from the subscription thread; hand the event over to the POX thread."""
+        core.callLater(self.handle_server_event, event, value)
+
+    def handle_server_event(self, event, value):
         """
-        Handles incoming packets at the switch. This function learns the source MAC addresses and decides whether to forward or drop packets based on their destination and type.
+        Keep the approval cache coherent with the server. While subscribed every change is pushed to us,
+        so cached answers are trusted for approval_cache_subscribed_ttl instead of the short polling TTLs.
         """
+        if event == 'add':
+            self.approval_cache.set(EthAddr(value), True)
+            self.install_approved_flows(EthAddr(value))
+        elif event in ('remove', 'expire'):
+            self.approval_cache.set(EthAddr(value), False)
+            self.remove_flows(EthAddr(value))
+        elif event == 'setHost':
+            self.captive_portal_mac = EthAddr(value)
+        elif event == 'setInternet':
+            self.internet_mac = EthAddr(value)
+        elif event == 'subscribed':
+            self.subscribed = True
+            self.approval_cache.ttl = self.approval_cache.negative_ttl = approval_cache_subscribed_ttl
+            self.invalidate()
+            self.warm_up()
+        elif event == 'disconnected' and self.subscribed:
+            self.subscribed = False
+            self.approval_cache.ttl = approval_cache_ttl
+            self.approval_cache.negative_ttl = approval_cache_negative_ttl
+            self.invalidate()
 
-        packet = event.parsed
+    def warm_up(self):
+        """Refill the approval cache for every learned MAC with a single checkMany round-trip."""
+        macs = [mac for mac in self.macToPort if mac not in (self.captive_portal_mac, self.internet_mac)]
+        if not macs:
+            return
+        try:
+            results = self.tcp_client.check_many([str(mac) for mac in macs])['result']
+        except (OSError, ValueError, KeyError) as e:
+            # Cache misses are checked one at a time instead
+            log.warning("Could not refill the approval cache: %s" % (e,))
+            return
+        for mac, approved in zip(macs, results):
+            self.approval_cache.set(mac, approved)
+
+    def remove_flows(self, mac):
+        """Delete every flow entry to or from mac, so its next packet comes back to the controller."""
+        for match in (of.ofp_match(dl_src=mac), of.ofp_match(dl_dst=mac)):
+            self.connection.send(of.ofp_flow_mod(command=of.OFPFC_DELETE, match=match))
 
+    def install_approved_flows(self, mac):
+        """
+        Program the switch for a newly approved MAC without waiting for a PacketIn. The captive portal
+        redirects installed while it was unapproved are exact matches and would shadow the new entries,
+        so they are flushed first. The entries also expire after approval_cache_subscribed_ttl however busy
+        they are: a 'remove' or 'expire' event lost while the subscription was down would otherwise never
+        take them out, and the client's next packet is checked against the server again.
+        """
+        self.remove_flows(mac)
+        mac_port = self.macToPort.get(mac)
+        internet_port = self.macToPort.get(self.internet_mac)
+        if mac_port is None or internet_port is None or mac_port == internet_port:
+            return
+        for src, dst, port in ((mac, self.internet_mac, internet_port), (self.internet_mac, mac, mac_port)):
+            msg = of.ofp_flow_mod()
+            msg.match = of.ofp_match(dl_src=src, dl_dst=dst)
+            msg.idle_timeout = approved_flow_idle_timeout
+            msg.hard_timeout = int(approval_cache_subscribed_ttl)
+            msg.actions.append(of.ofp_action_output(port = port))
+            self.connection.send(msg)
+
+    def refresh_host(self):
+        """Re-read the captive portal MAC from the server at most once per host_refresh_interval."""
+        if self.subscribed:
+            return
+        now = time.time()
+        if now - self.host_checked_at < host_refresh_interval:
+            return
+        self.host_checked_at = now
         response = EthAddr(self.tcp_client.get_host()['result'])
         if response and self.captive_portal_mac != response:
             self.captive_portal_mac = response
 
+    def _handle_PacketIn(self, event):
+        """
+        Handles incoming packets at the switch. This function learns the source MAC addresses and decides whether to forward or drop packets based on their destination and type.
+        """
+
+        packet = event.parsed
+
+        self.refresh_host()
+
         def flood():
             """
             Floods the packet to all ports except the one it arrived on. This is typically used for multicast packets or when the destination is unknown.
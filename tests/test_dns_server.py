@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import struct
+import socket
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import dns_server
+
+def encode_question(labels, qtype=dns_server.TYPE_A):
+    """Encode a query whose question name is made of labels, given as bytes."""
+    name = b''.join(bytes([len(label)]) + label for label in labels) + b'\x00'
+    return struct.pack('!HHHHHH', 0x1234, 0x0100, 1, 0, 0, 0) + name + struct.pack('!HH', qtype, dns_server.CLASS_IN)
+
+def nxdomain(query, ttl=300):
+    """An NXDOMAIN answer to query with an SOA in the authority section, cacheable for ttl seconds."""
+    end = dns_server.question_end(query)
+    soa = b'\x00' + b'\x00' + struct.pack('!IIIII', 1, 3600, 600, 86400, ttl)
+    record = struct.pack('!HHHIH', 0xc00c, dns_server.TYPE_SOA, dns_server.CLASS_IN, ttl, len(soa)) + soa
+    return query[:2] + struct.pack('!HHHHH', 0x8183, 1, 0, 1, 0) + query[12:end] + record
+
+def a_answer(query, address='93.184.216.34', ttl=300):
+    end = dns_server.question_end(query)
+    record = struct.pack('!HHHIH', 0xc00c, dns_server.TYPE_A, dns_server.CLASS_IN, ttl, 4) + socket.inet_aton(address)
+    return query[:2] + struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0) + query[12:end] + record
+
+class StubPool:
+    """Stands in for UpstreamPool, answering each query with answer(query) and recording the keys asked for."""
+    def __init__(self, answer):
+        self.answer = answer
+        self.keys = []
+        self.timeouts = self.coalesced = self.truncated = self.rotations = 0
+
+    def query(self, data, key=None):
+        self.keys.append(key)
+        return self.answer(data)
+
+class QuestionKeyTest(unittest.TestCase):
+    def test_dotted_label_differs_from_name(self):
+        dotted = encode_question([b'www.google', b'com'])
+        real = encode_question([b'www', b'google', b'com'])
+        # Same display name and same wire length, but different names
+        self.assertEqual(dns_server.parse_question(dotted)[0], dns_server.parse_question(real)[0])
+        self.assertEqual(len(dotted), len(real))
+        self.assertNotEqual(dns_server.question_key(dotted), dns_server.question_key(real))
+
+    def test_non_ascii_labels_differ(self):
+        self.assertNotEqual(dns_server.question_key(encode_question([b'\xe9', b'com'])), dns_server.question_key(encode_question([b'\xe8', b'com'])))
+
+    def test_letter_case_is_ignored_but_not_in_type(self):
+        self.assertEqual(dns_server.question_key(encode_question([b'WWW', b'Example', b'com'])), dns_server.question_key(encode_question([b'www', b'example', b'com'])))
+        # 0x41 and 0x61 are 'A' and 'a' as bytes, but different query types
+        self.assertNotEqual(dns_server.question_key(encode_question([b'example', b'com'], 0x41)), dns_server.question_key(encode_question([b'example', b'com'], 0x61)))
+
+    def test_compressed_question_is_rejected(self):
+        query = struct.pack('!HHHHHH', 1, 0x0100, 1, 0, 0, 0) + b'\x03www\xc0\x0c' + struct.pack('!HH', 1, 1)
+        self.assertIsNone(dns_server.parse_question(query))
+
+class ResolverCacheTest(unittest.TestCase):
+    def make_resolver(self, answer):
+        resolver = dns_server.DNSResolver(upstreams=[('127.0.0.1', 9)], cache=dns_server.DNSCache(), zone=dns_server.LocalZone([('portal.example', '10.0.0.1')]))
+        resolver.pool = StubPool(answer)
+        return resolver
+
+    def test_dotted_label_answer_does_not_poison_real_name(self):
+        resolver = self.make_resolver(lambda query: nxdomain(query) if b'\x0awww.google' in query else a_answer(query))
+        poisoned = resolver.resolve(encode_question([b'www.google', b'com']))
+        self.assertEqual(struct.unpack_from('!H', poisoned, 2)[0] & 0x000f, dns_server.RCODE_NXDOMAIN)
+        response = resolver.resolve(encode_question([b'www', b'google', b'com']))
+        self.assertEqual(struct.unpack_from('!H', response, 2)[0] & 0x000f, dns_server.RCODE_NOERROR)
+        self.assertEqual(len(resolver.pool.keys), 2)
+        self.assertNotEqual(resolver.pool.keys[0], resolver.pool.keys[1])
+
+    def test_hit_is_addressed_to_the_client(self):
+        resolver = self.make_resolver(a_answer)
+        resolver.resolve(encode_question([b'www', b'example', b'com']))
+        query = b'\x43\x21' + encode_question([b'WWW', b'example', b'com'])[2:]
+        response = resolver.resolve(query)
+        self.assertEqual(len(resolver.pool.keys), 1)
+        self.assertEqual(response[:2], b'\x43\x21')
+        self.assertEqual(response[12:dns_server.question_end(query)], query[12:dns_server.question_end(query)])
+
+    def test_deferred_miss_is_counted_once(self):
+        resolver = self.make_resolver(a_answer)
+        query = encode_question([b'www', b'example', b'com'])
+        miss = resolver.resolve(query, upstream=False)
+        self.assertIsInstance(miss, dns_server.Miss)
+        response = resolver.resolve_miss(query, miss)
+        self.assertEqual(response[-4:], socket.inet_aton('93.184.216.34'))
+        self.assertEqual((resolver.cache.hits, resolver.cache.misses), (0, 1))
+        self.assertEqual(len(resolver.pool.keys), 1)
+
+    def test_local_zone_matches_whole_labels_only(self):
+        resolver = self.make_resolver(nxdomain)
+        local = resolver.resolve(encode_question([b'portal', b'example']))
+        self.assertEqual(local[-4:], socket.inet_aton('10.0.0.1'))
+        resolver.resolve(encode_question([b'portal.example']))
+        self.assertEqual(resolver.local_answers, 1)
+
+class DNSCacheTest(unittest.TestCase):
+    def test_invalidate_does_not_take_the_lock(self):
+        cache = dns_server.DNSCache()
+        query = encode_question([b'www', b'example', b'com'])
+        key = dns_server.question_key(query)
+        cache.put(key, a_answer(query))
+        with cache.lock:
+            # As from a signal handler interrupting get() on the same thread
+            cache.invalidate()
+        self.assertIsNone(cache.get(key, query))
+        cache.put(key, a_answer(query))
+        self.assertIsNotNone(cache.get(key, query))
+
+class ApprovalTest(unittest.TestCase):
+    def make_resolver(self):
+        resolver = dns_server.DNSResolver(upstreams=[('127.0.0.1', 9)], cache=dns_server.DNSCache(), zone=dns_server.LocalZone([]), approvals=dns_server.ApprovalView())
+        resolver.pool = StubPool(a_answer)
+        return resolver
+
+    def test_approval_miss_is_left_off_the_receive_path(self):
+        resolver = self.make_resolver()
+        query = encode_question([b'www', b'example', b'com'])
+        miss = resolver.resolve(query, '00:00:00:00:00:01', upstream=False)
+        self.assertIsInstance(miss, dns_server.Miss)
+        self.assertIsNone(miss.approved)
+        resolver.approvals.set('00:00:00:00:00:01', False)
+        response = resolver.resolve(query, '00:00:00:00:00:01', upstream=False)
+        self.assertEqual(response[-4:], socket.inet_aton(dns_server.captive_portal_ip))
+
+    def test_fail_open_answer_is_cached_while_backing_off(self):
+        approvals = dns_server.ApprovalView()
+        approvals.retry_at = time.time() + 60
+        self.assertTrue(approvals.is_approved('00:00:00:00:00:02'))
+        self.assertIsNone(approvals.client)
+        self.assertTrue(approvals.cached('00:00:00:00:00:02'))
+
+    def test_fail_open_answer_is_short_lived_while_subscribed(self):
+        approvals = dns_server.ApprovalView()
+        approvals.on_event('subscribed', None)
+        approvals.retry_at = time.time() + 60
+        self.assertTrue(approvals.is_approved('00:00:00:00:00:03'))
+        self.assertLessEqual(approvals.entries['00:00:00:00:00:03'][1], time.time() + dns_server.approval_cache_negative_ttl)
+        approvals.set('00:00:00:00:00:04', False)
+        self.assertGreater(approvals.entries['00:00:00:00:00:04'][1], time.time() + dns_server.approval_cache_negative_ttl)
+
+class UpstreamPoolTest(unittest.TestCase):
+    def setUp(self):
+        # A stand-in upstream that answers every query and notes the port it came from
+        self.upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.upstream.bind(('127.0.0.1', 0))
+        self.upstream.settimeout(5)
+        self.ports = []
+
+    def tearDown(self):
+        self.upstream.close()
+
+    def answer(self, count):
+        for _ in range(count):
+            query, addr = self.upstream.recvfrom(dns_server.DNS_BUFFER_SIZE)
+            self.ports.append(addr[1])
+            self.upstream.sendto(a_answer(query), addr)
+
+    def test_socket_moves_to_new_port_after_rotate_queries(self):
+        pool = dns_server.UpstreamPool(upstreams=[self.upstream.getsockname()], sockets=1, timeout=1, attempts=1, rotate_queries=2, rotate_interval=3600)
+        query = encode_question([b'www', b'example', b'com'])
+        for _ in range(4):
+            threading.Thread(target=self.answer, args=(1,)).start()
+            response = pool.send(query, self.upstream.getsockname())
+            self.assertEqual(response[:2], query[:2])
+        self.assertEqual(self.ports[0], self.ports[1])
+        self.assertEqual(self.ports[2], self.ports[3])
+        self.assertNotEqual(self.ports[1], self.ports[2])
+        self.assertEqual(pool.rotations, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import socket
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pox_answer'))
+import tcp_client
+
+class EchoServer:
+    """Answers every request with {'result': True}, keeping the accepted connections so a test can drop them."""
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.connections = []
+        self.accepted = 0
+        threading.Thread(target=self.accept_forever, daemon=True).start()
+
+    def accept_forever(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            self.connections.append(conn)
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        try:
+            for line in conn.makefile('rb'):
+                request = json.loads(line)
+                conn.sendall((json.dumps({'id': request['id'], 'result': True}) + '\n').encode())
+        except OSError:
+            pass
+
+    def drop_connections(self):
+        connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+
+    def stop(self):
+        if self.sock.fileno() == -1:
+            return
+        # shutdown() also wakes the accept() blocked in the other thread
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+        self.drop_connections()
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = EchoServer()
+        self.client = tcp_client.TCPClient('127.0.0.1', self.server.sock.getsockname()[1])
+
+    def tearDown(self):
+        self.client.close_connection()
+        self.server.stop()
+
+    def test_request_after_server_drops_connection(self):
+        self.assertTrue(self.client.check_valid('00:00:00:00:00:01')['result'])
+        self.server.drop_connections()
+        self.assertTrue(self.client.check_many(['00:00:00:00:00:01'])['result'])
+        self.assertEqual(self.server.accepted, 2)
+
+    def test_second_failure_is_raised(self):
+        self.server.stop()
+        with self.assertRaises(OSError):
+            self.client.check_valid('00:00:00:00:00:01')
+
+if __name__ == '__main__':
+    unittest.main()
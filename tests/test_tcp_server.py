@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import tcp_server
+
+class HandleClientTest(unittest.TestCase):
+    def setUp(self):
+        self.limit = tcp_server.MAX_MESSAGE_SIZE
+        self.connect()
+
+    def connect(self):
+        self.server = tcp_server.Server(journal_file='')
+        self.client, conn = socket.socketpair()
+        self.client.settimeout(5)
+        self.thread = threading.Thread(target=self.server.handle_client, args=(conn, 'test'))
+        self.thread.start()
+        self.stream = self.client.makefile('rb')
+
+    def tearDown(self):
+        tcp_server.MAX_MESSAGE_SIZE = self.limit
+        self.stream.close()
+        self.client.close()
+        self.thread.join(5)
+
+    def request(self, line):
+        self.client.sendall(line)
+        return json.loads(self.stream.readline())
+
+    def test_invalid_utf8_line_gets_an_error(self):
+        self.assertEqual(self.request(b'\xff\xfe\x00garbage\n'), {'error': 'Invalid JSON'})
+        self.assertEqual(self.request(b'{"command": "check", "value": "00:00:00:00:00:01", "id": 1}\n'), {'result': False, 'id': 1})
+
+    def test_overlong_line_closes_the_connection(self):
+        self.tearDown()
+        tcp_server.MAX_MESSAGE_SIZE = 64
+        self.connect()
+        self.client.sendall(b'{"command": "check", "value": "' + b'0' * 100 + b'"}\n')
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(self.stream.readline(), b'')
+
+def colliding_macs(count, mask):
+    """The first count MACs whose home slot in a table of mask + 1 slots is 0."""
+    macs = []
+    mac = 0
+    while len(macs) < count:
+        if tcp_server.MACTable.slot(mac, mask) == 0:
+            macs.append(mac)
+        mac += 1
+    return macs
+
+class MACTableTest(unittest.TestCase):
+    def test_set_get_delete(self):
+        table = tcp_server.MACTable()
+        table.set(0x00005e005301, 1000)
+        table.set(0x00005e005301, 2000)
+        self.assertEqual(table.get(0x00005e005301), 2000)
+        self.assertEqual(len(table), 1)
+        self.assertIsNone(table.get(0x00005e005302))
+        self.assertTrue(table.delete(0x00005e005301))
+        self.assertFalse(table.delete(0x00005e005301))
+        self.assertIsNone(table.get(0x00005e005301))
+        self.assertEqual(len(table), 0)
+
+    def test_mac_zero_and_all_ones(self):
+        table = tcp_server.MACTable()
+        table.set(0, 1)
+        table.set(tcp_server.MAC_MASK, 2)
+        self.assertEqual((table.get(0), table.get(tcp_server.MAC_MASK)), (1, 2))
+
+    def test_tombstone_keeps_the_probe_chain(self):
+        table = tcp_server.MACTable(capacity=16)
+        first, second, third = colliding_macs(3, 15)
+        for expires_at, mac in enumerate((first, second, third), 1):
+            table.set(mac, expires_at)
+        table.delete(second)
+        self.assertEqual(table.get(third), 3)
+        self.assertIsNone(table.get(second))
+        # A re-insert takes the tombstone's slot instead of a fresh one
+        used = table.used
+        table.set(second, 4)
+        self.assertEqual(table.used, used)
+        self.assertEqual([table.get(mac) for mac in (first, second, third)], [1, 4, 3])
+
+    def test_grows_and_keeps_every_entry(self):
+        table = tcp_server.MACTable(capacity=8)
+        for mac in range(1000):
+            table.set(mac, mac + 1)
+        self.assertEqual(len(table), 1000)
+        self.assertGreaterEqual(len(table.slots[0]) * 7, table.used * 10)
+        self.assertTrue(all(table.get(mac) == mac + 1 for mac in range(1000)))
+
+    def test_churn_rehashes_tombstones_away(self):
+        table = tcp_server.MACTable(capacity=64)
+        for mac in range(10000):
+            table.set(mac, 1)
+            table.delete(mac)
+        self.assertEqual(len(table), 0)
+        self.assertEqual(len(table.slots[0]), 64)
+        self.assertLessEqual(table.used * 10, 64 * 7)
+
+    def test_copy_round_trips_through_the_columns(self):
+        table = tcp_server.MACTable()
+        for mac in range(100):
+            table.set(mac, mac + 1)
+        table.delete(50)
+        keys, expiries = table.copy()
+        restored = tcp_server.MACTable(keys=keys, expiries=expiries)
+        self.assertEqual(len(restored), 99)
+        self.assertEqual(sorted(restored.items()), sorted(table.items()))
+
+class MACJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = self.make_journal()
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def make_journal(self):
+        return tcp_server.MACJournal(journal_file=os.path.join(self.directory, 'journal'), snapshot_file=os.path.join(self.directory, 'snapshot'), fsync='always')
+
+    def reopen(self):
+        """Restore from disk as a restarted server would. Every append was already fsynced, so this is what a crash would leave."""
+        self.journal.close()
+        self.journal = self.make_journal()
+        return dict(self.journal.open().items())
+
+    def test_adds_and_removes_are_replayed(self):
+        self.journal.open()
+        self.journal.record_adds([1, 2, 3], 5000)
+        self.journal.record_remove(2)
+        self.assertEqual(self.reopen(), {1: 5000, 3: 5000})
+
+    def test_torn_last_line_is_ignored(self):
+        self.journal.open()
+        self.journal.record_adds([1], 5000)
+        self.journal.file.write('+ 0000000')
+        self.journal.file.flush()
+        self.assertEqual(self.reopen(), {1: 5000})
+
+    def test_compaction_writes_a_snapshot_and_drops_the_journal(self):
+        table = self.journal.open()
+        table.set(1, 5000)
+        self.journal.record_adds([1], 5000)
+        self.journal.rotate()
+        self.journal.write_snapshot(table.copy())
+        self.assertFalse(os.path.exists(self.journal.rotated_file))
+        self.assertEqual(os.path.getsize(self.journal.journal_file), 0)
+        self.assertEqual(self.reopen(), {1: 5000})
+
+    def test_crash_before_the_snapshot_lands_replays_the_rotated_journal(self):
+        self.journal.open()
+        self.journal.record_adds([1], 5000)
+        self.journal.rotate()
+        self.journal.record_adds([2], 6000)
+        self.assertEqual(self.reopen(), {1: 5000, 2: 6000})
+
+    def test_second_rotation_keeps_records_in_order(self):
+        self.journal.open()
+        self.journal.record_adds([1, 2], 5000)
+        self.journal.rotate()
+        # The snapshot never landed; the next rotation appends to the leftover .old journal
+        self.journal.record_remove(1)
+        self.journal.record_adds([3], 6000)
+        self.journal.rotate()
+        self.assertEqual(self.reopen(), {2: 5000, 3: 6000})
+
+    def test_snapshot_then_journal(self):
+        table = self.journal.open()
+        table.set(1, 5000)
+        table.set(2, 5000)
+        self.journal.record_adds([1, 2], 5000)
+        self.journal.rotate()
+        self.journal.write_snapshot(table.copy())
+        self.journal.record_remove(1)
+        self.assertEqual(self.reopen(), {2: 5000})
+
+class MACSetExpiryTest(unittest.TestCase):
+    def setUp(self):
+        self.macs = tcp_server.MACSet(valid_time=60, bucket=1)
+
+    def test_expire_evicts_only_lapsed_sessions(self):
+        self.macs.add_macs([1, 2])
+        expires_at = self.macs.table.get(1)
+        self.assertEqual(self.macs.expire(expires_at - 1), [])
+        self.assertEqual(sorted(self.macs.expire(expires_at)), [1, 2])
+        self.assertEqual(len(self.macs.table), 0)
+        self.assertEqual(self.macs.expiry_wheel, {})
+
+    def test_partly_due_bucket_keeps_the_rest(self):
+        self.macs.table.set(1, 10500)
+        self.macs.schedule(1, 10500)
+        self.macs.table.set(2, 10900)
+        self.macs.schedule(2, 10900)
+        self.assertEqual(self.macs.expire(10600), [1])
+        self.assertEqual(self.macs.expire(10900), [2])
+
+    def test_readd_supersedes_the_earlier_expiry(self):
+        self.macs.add_macs([1])
+        first = self.macs.table.get(1)
+        self.macs.table.set(1, first + 5000)
+        self.macs.schedule(1, first + 5000)
+        self.assertEqual(self.macs.expire(first + 1000), [])
+        self.assertTrue(self.macs.table.get(1))
+        self.assertEqual(self.macs.expire(first + 5000), [1])
+
+    def test_removed_mac_is_not_reported(self):
+        self.macs.add_macs([1])
+        expires_at = self.macs.table.get(1)
+        self.macs.remove_mac(1)
+        self.assertEqual(self.macs.expire(expires_at), [])
+
+    def test_stale_entries_are_compacted(self):
+        for _ in range(3):
+            self.macs.add_macs(list(range(1000)))
+        self.assertLessEqual(self.macs.scheduled, 2 * len(self.macs.table) + 1024)
+
+    def test_restore_schedules_every_entry(self):
+        table = tcp_server.MACTable()
+        table.set(1, 1000)
+        table.set(2, 5000)
+        self.macs.restore(table)
+        self.assertEqual(self.macs.expire(1000), [1])
+        self.assertEqual(self.macs.expire(5000), [2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import threading
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'answer'))
+import web_server
+
+class StaticAssetsTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'index.html'), 'w') as f:
+            f.write('<p>captive portal</p>' * 100)
+        self.assets = web_server.StaticAssets(root=self.root, reload=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_each_encoding_has_its_own_etag(self):
+        variants, _ = self.assets.get('/index.html')
+        etags = {encoding: variant[2] for encoding, variant in variants.items()}
+        self.assertIn('gzip', etags)
+        self.assertEqual(len(set(etags.values())), len(etags))
+        self.assertEqual(etags['gzip'], etags['identity'][:-1] + '-gzip"')
+        for encoding, (headers, _, etag, not_modified) in variants.items():
+            self.assertIn(f'ETag: {etag}\r\n'.encode(), headers)
+            self.assertIn(f'ETag: {etag}\r\n'.encode(), not_modified)
+
+def closed_port():
+    """A local port nothing listens on."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class AuthServer:
+    """Stands in for the authorization server: answers every request with {'result': True}, or never if silent."""
+    def __init__(self, silent=False):
+        self.silent = silent
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.connections = []
+        self.accepted = 0
+        threading.Thread(target=self.accept_forever, daemon=True).start()
+
+    def accept_forever(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            self.connections.append(conn)
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        try:
+            for line in conn.makefile('rb'):
+                if not self.silent:
+                    conn.sendall((json.dumps({'id': json.loads(line)['id'], 'result': True}) + '\n').encode())
+        except OSError:
+            pass
+
+    def drop_connections(self):
+        connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+
+    def stop(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+        self.drop_connections()
+
+class AuthClientPoolTest(unittest.TestCase):
+    def make_pool(self, port, **options):
+        settings = dict(size=2, timeout=0.5, health_interval=60, backoff=0.2, backoff_max=1, breaker_threshold=3, breaker_reset=0.3)
+        settings.update(options)
+        pool = web_server.AuthClientPool('127.0.0.1', port, **settings)
+        self.addCleanup(pool.close)
+        return pool
+
+    def serve(self, **options):
+        server = AuthServer(**options)
+        self.addCleanup(server.stop)
+        return server
+
+    def test_connection_is_reused(self):
+        server = self.serve()
+        pool = self.make_pool(server.port)
+        for _ in range(3):
+            self.assertTrue(pool.set_valid('00:00:00:00:00:01')['result'])
+        self.assertEqual(server.accepted, 1)
+
+    def test_connection_closed_by_server_is_replaced(self):
+        server = self.serve()
+        pool = self.make_pool(server.port)
+        pool.set_valid('00:00:00:00:00:01')
+        server.drop_connections()
+        time.sleep(0.05)
+        self.assertTrue(pool.set_valid('00:00:00:00:00:01')['result'])
+        self.assertEqual(server.accepted, 2)
+
+    def test_call_is_bounded_by_timeout(self):
+        server = self.serve(silent=True)
+        pool = self.make_pool(server.port, timeout=0.2)
+        start = time.time()
+        with self.assertRaises(OSError):
+            pool.set_valid('00:00:00:00:00:01')
+        self.assertLess(time.time() - start, 2)
+        # The connection that timed out is not handed out again
+        self.assertEqual((pool.idle, pool.created), ([], 0))
+
+    def test_failed_connect_backs_off(self):
+        pool = self.make_pool(closed_port(), breaker_threshold=100)
+        with self.assertRaises(ConnectionRefusedError):
+            pool.set_valid('00:00:00:00:00:01')
+        # Within the backoff the call fails without trying to connect
+        with self.assertRaises(web_server.AuthUnavailableError):
+            pool.set_valid('00:00:00:00:00:01')
+        time.sleep(0.25)
+        with self.assertRaises(ConnectionRefusedError):
+            pool.set_valid('00:00:00:00:00:01')
+        # The delay doubles after each failed connect
+        self.assertAlmostEqual(pool.connect_delay, 0.4)
+
+    def test_breaker_opens_and_closes_after_a_successful_trial(self):
+        pool = self.make_pool(closed_port(), backoff=0)
+        for _ in range(3):
+            with self.assertRaises(ConnectionRefusedError):
+                pool.set_valid('00:00:00:00:00:01')
+        with self.assertRaises(web_server.AuthUnavailableError):
+            pool.set_valid('00:00:00:00:00:01')
+        server = self.serve()
+        pool.port = server.port
+        time.sleep(0.35)
+        self.assertTrue(pool.set_valid('00:00:00:00:00:01')['result'])
+        self.assertEqual(pool.failures, 0)
+
+    def test_failed_trial_reopens_the_breaker(self):
+        pool = self.make_pool(closed_port(), backoff=0)
+        for _ in range(3):
+            with self.assertRaises(ConnectionRefusedError):
+                pool.set_valid('00:00:00:00:00:01')
+        time.sleep(0.35)
+        with self.assertRaises(ConnectionRefusedError):
+            pool.set_valid('00:00:00:00:00:01')
+        with self.assertRaises(web_server.AuthUnavailableError):
+            pool.set_valid('00:00:00:00:00:01')
+
+    def test_only_one_trial_at_a_time(self):
+        pool = self.make_pool(closed_port(), backoff=0)
+        for _ in range(3):
+            with self.assertRaises(ConnectionRefusedError):
+                pool.set_valid('00:00:00:00:00:01')
+        time.sleep(0.35)
+        # As if another thread's trial call were still in flight
+        pool.before_call()
+        with self.assertRaises(web_server.AuthUnavailableError):
+            pool.set_valid('00:00:00:00:00:01')
+
+if __name__ == '__main__':
+    unittest.main()